@@ -0,0 +1,255 @@
+"""Planning many start/goal queries against one map.
+
+BatchPlanner loads an Environment and builds a PRM roadmap once. It then
+answers batches of (start, goal) queries on a process pool and yields each
+Path (or None) as soon as it is found:
+
+    with BatchPlanner('Denali_650.yaml', processes=4) as planner:
+        for i, path in planner.plan(queries):
+            ...
+
+plan_async() is the same stream as an async generator. Repeated queries
+are answered from an LRU cache keyed by (start, goal, environment version).
+"""
+import asyncio
+import collections
+import concurrent.futures
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from environment import Environment
+from graph import FrozenGraph
+from sampling_planners import PRM
+from search import astar_search, euclidean_heuristic
+
+
+class _QueryGraph(object):
+    """A FrozenGraph plus the extra edges joining one query to it."""
+    def __init__(self, graph, extra):
+        self.graph = graph
+        self.extra = extra
+
+    def neighbors(self, node):
+        if node in self.graph:
+            for edge in self.graph.neighbors(node):
+                yield edge
+        for edge in self.extra.get(node, ()):
+            yield edge
+
+
+class QueryPlanner(object):
+    """Answers queries on a fixed roadmap without changing it: start is
+    joined to its k nearest roadmap nodes, and they are joined to goal,
+    wherever the straight segment is free. Every query of a chunk is
+    connected with one batched collision check."""
+    def __init__(self, env, roadmap, k=10):
+        self.env = env
+        self.roadmap = roadmap
+        self.k = k
+        self.points = np.array(roadmap.labels, dtype=float).reshape(-1, 2)
+        self.tree = cKDTree(self.points) if len(self.points) else None
+
+    @classmethod
+    def load(cls, path, robot_radius, k=10):
+        """A QueryPlanner over the environment and roadmap that
+        BatchPlanner wrote to directory path. Only the roadmap's indptr,
+        indices and weights arrays stay memory-mapped and shared between
+        processes; the obstacle polygons, their collision index, the
+        roadmap labels and the k-d tree are rebuilt in each process."""
+        env = Environment(use_cache=False)
+        env.robot_radius = robot_radius
+        env.load_from_binary(os.path.join(path, 'environment.envbin'))
+        return cls(env, FrozenGraph.load(os.path.join(path, 'roadmap')), k)
+
+    def plan_chunk(self, queries):
+        """[(i, path)] for a list of (i, start, goal) queries."""
+        env = self.env
+        starts = np.array([q[1][:2] for q in queries], dtype=float).reshape(-1, 2)
+        goals = np.array([q[2][:2] for q in queries], dtype=float).reshape(-1, 2)
+        ok = ~(env.points_in_collision(starts) | env.points_in_collision(goals))
+        k = min(self.k, len(self.points))
+        # Candidate segments as (query, from, to, roadmap node or -1, to goal).
+        segments = []
+        for n in np.nonzero(ok)[0].tolist():
+            s, g = starts[n], goals[n]
+            segments.append((n, s, g, -1, True))
+            for p, to_goal in ((s, False), (g, True)) if k else ():
+                _, nbrs = self.tree.query(p, k=k)
+                for j in np.atleast_1d(nbrs).tolist():
+                    segments.append((n, p, self.points[j], j, to_goal))
+        free = []
+        if segments:
+            a = np.array([seg[1] for seg in segments])
+            b = np.array([seg[2] for seg in segments])
+            free = ~env.segments_in_collision(a, b)
+        extra = [{} for _ in queries]
+        labels = self.roadmap.labels
+        for (n, p, q, j, to_goal), f in zip(segments, free):
+            if not f:
+                continue
+            start, goal = tuple(starts[n].tolist()), tuple(goals[n].tolist())
+            w = math.hypot(p[0] - q[0], p[1] - q[1])
+            source = start if j < 0 or not to_goal else labels[j]
+            target = goal if to_goal else labels[j]
+            extra[n].setdefault(source, []).append((target, w))
+        out = []
+        for n, (i, _, _) in enumerate(queries):
+            path = None
+            if ok[n]:
+                start, goal = tuple(starts[n].tolist()), tuple(goals[n].tolist())
+                path = astar_search(_QueryGraph(self.roadmap, extra[n]), start, goal, euclidean_heuristic)
+            out.append((i, path))
+        return out
+
+
+_worker = None
+
+def _init_query_worker(path, robot_radius, k):
+    global _worker
+    _worker = QueryPlanner.load(path, robot_radius, k)
+
+def _plan_chunk(queries):
+    return _worker.plan_chunk(queries)
+
+
+class BatchPlanner(object):
+    """Answers start/goal queries against one environment in bulk.
+
+    env is an Environment or a YAML file to load one from. The PRM roadmap
+    (n_samples, k, seed) is built once and frozen. With processes > 1
+    (default: one per CPU) the environment and roadmap are written to a
+    temporary directory and each worker of a process pool loads them once
+    (see QueryPlanner.load), keeping its query planner for the life of the
+    pool; only queries and Paths cross process boundaries. Each worker
+    holds its own copy of everything but the roadmap's edge arrays, and
+    how well throughput scales with processes depends on the machine
+    (benchmarks.py batch_planning reports it). With processes=1 queries
+    run in a background thread instead.
+
+    Results are kept in an LRU cache of cache_size entries keyed by
+    (start, goal, version), where version is the environment's version
+    and robot radius. If either changes, the roadmap and the pool are
+    rebuilt before the next batch. hits and misses count cache lookups.
+    Call close() (or use a with block) to stop the pool."""
+    def __init__(self, env, n_samples=2000, k=10, seed=0, processes=None, cache_size=4096):
+        self.env = env if isinstance(env, Environment) else Environment(env)
+        self.n_samples = n_samples
+        self.k = k
+        self.seed = seed
+        self.processes = processes or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.hits = self.misses = 0
+        self.version = None
+        self._executor = None
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _build(self):
+        """(Re)build the roadmap and the workers if the environment changed."""
+        version = (self.env.version, self.env.robot_radius)
+        if version == self.version and self._executor is not None:
+            return
+        self.close()
+        self.roadmap = PRM(self.env, self.n_samples, self.k, seed=self.seed).roadmap.freeze()
+        if self.processes > 1:
+            self._path = tempfile.mkdtemp()
+            self.env.save_to_binary(os.path.join(self._path, 'environment.envbin'))
+            self.roadmap.save(os.path.join(self._path, 'roadmap'))
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.processes, initializer=_init_query_worker,
+                initargs=(self._path, self.env.robot_radius, self.k))
+            self._run = _plan_chunk
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(1)
+            self._run = QueryPlanner(self.env, self.roadmap, self.k).plan_chunk
+        self.version = version
+
+    def close(self):
+        """Stop the workers and remove their shared files."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._path is not None:
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._path = None
+
+    def _key(self, start, goal):
+        return (tuple(float(c) for c in start[:2]), tuple(float(c) for c in goal[:2]), self.version)
+
+    def _remember(self, key, path):
+        self.cache[key] = path
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _submit(self, queries, chunksize):
+        """Split off the cached queries. Submit the rest in chunks, with
+        each distinct query planned once. Returns (cached, futures, waiting),
+        where cached is a list of (i, path), futures the submitted chunks
+        and waiting maps each submitted key to the indices that asked
+        for it."""
+        self._build()
+        cached, waiting, todo = [], {}, []
+        for i, (start, goal) in enumerate(queries):
+            key = self._key(start, goal)
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                cached.append((i, self.cache[key]))
+            elif key in waiting:
+                self.hits += 1
+                waiting[key].append(i)
+            else:
+                self.misses += 1
+                waiting[key] = [i]
+                todo.append((key, key[0], key[1]))
+        if chunksize is None:
+            chunksize = max(1, min(256, -(-len(todo) // (4 * self.processes))))
+        futures = [self._executor.submit(self._run, todo[lo:lo+chunksize])
+                   for lo in range(0, len(todo), chunksize)]
+        return cached, futures, waiting
+
+    def _finish(self, chunk, waiting):
+        for key, path in chunk:
+            self._remember(key, path)
+            for i in waiting.pop(key):
+                yield i, path
+
+    def plan(self, queries, chunksize=None):
+        """Yields (i, path) for each (start, goal) in queries, in the order
+        the paths are found; path is None where there is none. Cached
+        answers come first."""
+        cached, futures, waiting = self._submit(list(queries), chunksize)
+        for item in cached:
+            yield item
+        for future in concurrent.futures.as_completed(futures):
+            for item in self._finish(future.result(), waiting):
+                yield item
+
+    def plan_all(self, queries, chunksize=None):
+        """The paths for queries, in query order."""
+        queries = list(queries)
+        paths = [None] * len(queries)
+        for i, path in self.plan(queries, chunksize):
+            paths[i] = path
+        return paths
+
+    async def plan_async(self, queries, chunksize=None):
+        """plan() as an async generator. The event loop stays free while
+        the workers search."""
+        cached, futures, waiting = self._submit(list(queries), chunksize)
+        for item in cached:
+            yield item
+        for future in asyncio.as_completed([asyncio.wrap_future(f) for f in futures]):
+            for item in self._finish(await future, waiting):
+                yield item
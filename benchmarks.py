@@ -0,0 +1,909 @@
+"""Micro-benchmarks for the planning code.
+
+Run from the repository root, e.g.
+
+    python benchmarks.py priority_queue
+
+The stages benchmark times each step of the planning pipeline per scene.
+Write its results with --json and check a later run against them with
+--baseline, which exits with status 1 if a stage got slower:
+
+    python benchmarks.py stages --json baseline.json
+    python benchmarks.py stages --baseline baseline.json
+"""
+import argparse
+import bisect
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import yaml
+from shapely.geometry import LineString, Point, Polygon
+
+from batch_planning import BatchPlanner
+from constraint_astar import (Constraint, best_first_assignments, conflict_directed_astar,
+                              constraint_based_astar, probability_queue)
+from environment import (Environment, ObstacleStream, generate_random_environment, random_environment,
+                         repair_polygon)
+from graph import Graph
+from incremental_search import DStarLite
+from sampling_planners import PRM, rrt_star, sample_free
+from search import astar_search, euclidean_heuristic
+from search_classes import NodePool, SearchNode, SearchStats, Path
+from tour import held_karp, nearest_neighbor_tour, solve_tour, tour_cost
+from utils import PriorityQueue, Queue, some, update
+from visibility_graph import VisibilityGraph
+
+
+class SortedListPriorityQueue(Queue):
+    """The original bisect/sorted-list PriorityQueue, kept as a reference point."""
+    def __init__(self, order=min, f=lambda x: x):
+        update(self, A=[], order=order, f=f)
+    def append(self, item):
+        bisect.insort(self.A, (self.f(item), item))
+    def __len__(self):
+        return len(self.A)
+    def pop(self):
+        if self.order == min:
+            return self.A.pop(0)[1]
+        else:
+            return self.A.pop()[1]
+    def __contains__(self, item):
+        return some(lambda x : x[1] == item, self.A)
+    def __getitem__(self, key):
+        for _, item in self.A:
+            if item == key:
+                return item
+    def __delitem__(self, key):
+        for i, (value, item) in enumerate(self.A):
+            if item == key:
+                self.A.pop(i)
+                return
+
+
+def timed(fn, *args, **kwargs):
+    """Return (seconds, result) of a single call."""
+    t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - t, result
+
+
+def _frontier_workload(queue_cls, n, seed):
+    """Best-first-search style workload: push n states, re-prioritise a
+    quarter of them through the membership/lookup/delete idiom, pop all."""
+    rng = random.Random(seed)
+    cost = {}
+    q = queue_cls(min, lambda s: cost[s])
+    for s in range(n):
+        cost[s] = rng.random()
+        q.append(s)
+    for s in rng.sample(range(n), n // 4):
+        new_cost = cost[s] * 0.5
+        if s in q and new_cost < cost[q[s]]:
+            del q[s]
+            cost[s] = new_cost
+            q.append(s)
+    out = []
+    while len(q):
+        out.append(q.pop())
+    return out
+
+
+def bench_priority_queue(sizes=(1000, 5000, 20000), seed=0):
+    rows = []
+    for n in sizes:
+        t_old, old = timed(_frontier_workload, SortedListPriorityQueue, n, seed)
+        t_new, new = timed(_frontier_workload, PriorityQueue, n, seed)
+        assert len(old) == len(new) == n
+        rows.append((n, t_old, t_new))
+        print("priority_queue n=%6d  sorted list: %8.4fs  indexed heap: %8.4fs  speedup: %6.1fx"
+              % (n, t_old, t_new, t_old / t_new))
+    return rows
+
+
+def bench_collision(scenes=('denali.yaml', 'Denali_650.yaml'), n=5000, seed=0):
+    """Per-geometry collision loops (brute force over expanded_obstacles and
+    through the STRtree index) against the batched array checks."""
+    rows = []
+    for scene in scenes:
+        env = Environment(scene)
+        rng = np.random.default_rng(seed)
+        minx, miny, maxx, maxy = env.bounds
+        starts = rng.uniform((minx, miny), (maxx, maxy), size=(n, 2))
+        ends = starts + rng.uniform(-1.0, 1.0, size=(n, 2))
+        obstacles = env.expanded_obstacles
+
+        t_loop, loop = timed(lambda: [any(o.intersects(Point(p)) for o in obstacles) for p in starts])
+        t_index, index = timed(lambda: [env.point_in_collision(p) for p in starts])
+        t_batch, batch = timed(env.points_in_collision, starts)
+        assert list(batch) == loop == index
+        rows.append((scene, 'points', n, t_loop, t_index, t_batch))
+
+        t_loop, loop = timed(lambda: [any(o.intersects(LineString([p, q])) for o in obstacles)
+                                      for p, q in zip(starts, ends)])
+        t_index, index = timed(lambda: [env.segment_in_collision(p, q) for p, q in zip(starts, ends)])
+        t_batch, batch = timed(env.segments_in_collision, starts, ends)
+        assert list(batch) == loop == index
+        rows.append((scene, 'segments', n, t_loop, t_index, t_batch))
+
+    for scene, kind, n, t_loop, t_index, t_batch in rows:
+        print("collision %-16s %-8s n=%d  loop: %8.4fs  indexed: %8.4fs  batched: %8.4fs  speedup: %6.1fx / %6.1fx"
+              % (scene, kind, n, t_loop, t_index, t_batch, t_loop / t_batch, t_index / t_batch))
+    return rows
+
+
+class LatticeGraph(object):
+    """Implicit 4-connected n x n grid with unit weights, big enough to
+    make a search expand millions of nodes without building a Graph."""
+    def __init__(self, n):
+        self.n = n
+    def neighbors(self, state):
+        r, c = state
+        n = self.n
+        if r > 0: yield (r - 1, c), 1.0
+        if r < n - 1: yield (r + 1, c), 1.0
+        if c > 0: yield (r, c - 1), 1.0
+        if c < n - 1: yield (r, c + 1), 1.0
+
+
+class DictSearchNode(object):
+    """SearchNode as it was before __slots__, with a per-instance __dict__."""
+    def __init__(self, state, parent_node=None, cost=0.0, action=None):
+        self._parent = parent_node
+        self._state = state
+        self._action = action
+        self._cost = cost
+    state = property(lambda self: self._state)
+    parent = property(lambda self: self._parent)
+    cost = property(lambda self: self._cost)
+    action = property(lambda self: self._action)
+    def __eq__(self, other):
+        return isinstance(other, DictSearchNode) and self._state == other._state
+    def __hash__(self):
+        return hash(self._state)
+    def __gt__(self, other):
+        return self._cost > other._cost
+
+
+def node_object_astar_search(graph, start, goal, heuristic=None, node_cls=SearchNode):
+    """astar_search as it was before NodePool: one node object per generated
+    node, with the frontier keyed on node equality."""
+    h = (lambda state: heuristic(state, goal)) if heuristic else (lambda state: 0.0)
+    frontier = PriorityQueue(min, lambda node: node.cost + h(node.state))
+    frontier.append(node_cls(start))
+    explored = set()
+    while len(frontier):
+        node = frontier.pop()
+        if node.state == goal:
+            return Path(node)
+        explored.add(node.state)
+        for target, weight in graph.neighbors(node.state):
+            if target in explored:
+                continue
+            child = node_cls(target, node, node.cost + weight, (node.state, target))
+            queued = frontier[child]
+            if queued is None or child.cost < queued.cost:
+                frontier.append(child)
+    return None
+
+
+def bench_node_storage(n=1000):
+    """Uniform cost search corner to corner over an n x n lattice, which
+    expands all n*n nodes: node objects with a __dict__, with __slots__, and
+    a NodePool."""
+    graph = LatticeGraph(n)
+    start, goal = (0, 0), (n - 1, n - 1)
+    variants = [('__dict__ nodes', lambda: node_object_astar_search(graph, start, goal, node_cls=DictSearchNode)),
+                ('__slots__ nodes', lambda: node_object_astar_search(graph, start, goal)),
+                ('NodePool', lambda: astar_search(graph, start, goal))]
+    rows = []
+    for label, search in variants:
+        t, path = timed(search)
+        assert path.cost == 2 * (n - 1)
+        tracemalloc.start()
+        search()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rows.append((label, n * n, t, peak))
+        print("node_storage %-15s expanded=%d  time: %7.2fs  peak memory: %7.1f MB (%5.1f B/node)"
+              % (label, n * n, t, peak / 1e6, peak / float(n * n)))
+    return rows
+
+
+
+def bench_instrumentation(n=400):
+    """astar_search over an n x n lattice with and without a SearchStats,
+    and where the instrumented run says the time went."""
+    graph = LatticeGraph(n)
+    start, goal = (0, 0), (n - 1, n - 1)
+    t_off, _ = timed(astar_search, graph, start, goal)
+    stats = SearchStats()
+    t_on, _ = timed(astar_search, graph, start, goal, stats=stats)
+    phases = "  ".join("%s: %.3fs" % (phase, t) for phase, t in sorted(stats.times.items()))
+    print("instrumentation expanded=%d  plain: %7.3fs  with stats: %7.3fs (%+.0f%%)  %s"
+          % (stats.expanded, t_off, t_on, 100 * (t_on / t_off - 1), phases))
+    return [(t_off, t_on, stats.as_dict())]
+
+# A start/goal pair per bundled scene, both in the largest free component
+# for the default robot radius. Denali_650's is a narrow corridor along
+# the top edge; the rest of that map is blocked at this radius.
+SCENE_QUERIES = {
+    'simple.yaml': ((-2.7, -1.3), (11.3, -3.9)),
+    'denali.yaml': ((-4.0, -2.0), (12.5, 3.5)),
+    'Denali_650.yaml': ((5.5, 5.35), (8.5, 5.35)),
+}
+
+
+def bench_sampling_planners(seeds=(0, 1, 2), n_samples=2000, k=10, n_iterations=3000):
+    """PRM (roadmap build plus one query) and RRT* on each bundled scene,
+    averaged over seeds: mean time, number of runs that found a path and
+    mean cost of those paths."""
+    rows = []
+    for scene, (start, goal) in sorted(SCENE_QUERIES.items()):
+        env = Environment(scene)
+        planners = (('PRM', lambda seed: PRM(env, n_samples, k, seed=seed).query(start, goal)),
+                    ('RRT*', lambda seed: rrt_star(env, start, goal, n_iterations, seed=seed)))
+        for planner, plan in planners:
+            runs = [timed(plan, seed) for seed in seeds]
+            costs = [path.cost for _, path in runs if path is not None]
+            t = sum(t for t, _ in runs) / len(runs)
+            cost = sum(costs) / len(costs) if costs else None
+            rows.append((scene, planner, t, len(costs), cost))
+            print("sampling_planners %-16s %-5s time: %7.3fs  solved: %d/%d  cost: %s"
+                  % (scene, planner, t, len(costs), len(runs), "%.3f" % cost if costs else "-"))
+    return rows
+
+
+
+def bench_distance_matrix(seed=0, n_samples=3000, k=10, n_points=20, processes=(1, 2), dense_nodes=200):
+    """Cost matrix between n_points roadmap nodes of the denali PRM: one A*
+    per pair against Graph.distance_matrix (one Dijkstra per source, over
+    process pools of each size, then a cached repeat). Then all pairs of a
+    complete graph of dense_nodes nodes with Dijkstra and Floyd-Warshall."""
+    rows = []
+    env = Environment('denali.yaml')
+    graph = PRM(env, n_samples, k, seed=seed).roadmap
+    points = random.Random(seed).sample(sorted(graph._nodes), n_points)
+    t_pairs, pairs = timed(lambda: [[astar_search(graph, a, b, euclidean_heuristic) for b in points]
+                                    for a in points])
+    reference = np.array([[p.cost if p else np.inf for p in row] for row in pairs])
+    print("distance_matrix roadmap %d nodes, %dx%d  A* per pair: %7.3fs" % (len(graph._nodes), n_points, n_points, t_pairs))
+    for n in processes:
+        graph.version += 1  # Drop the cached matrix so each run recomputes it.
+        t, matrix = timed(graph.distance_matrix, points, processes=n, method='dijkstra')
+        assert np.allclose(matrix, reference)
+        rows.append(('roadmap', 'dijkstra x%d' % n, t))
+        print("distance_matrix roadmap  dijkstra, %d process(es): %7.3fs" % (n, t))
+    t, _ = timed(graph.distance_matrix, points, processes=1, method='dijkstra')
+    rows.append(('roadmap', 'cached', t))
+    print("distance_matrix roadmap  cached repeat: %10.6fs" % t)
+
+    rng = np.random.default_rng(seed)
+    dense = Graph()
+    weights = rng.uniform(1, 10, size=(dense_nodes, dense_nodes))
+    for i in range(dense_nodes):
+        for j in range(dense_nodes):
+            if i != j:
+                dense.add_edge(i, j, float(weights[i, j]), bidirectional=False)
+    nodes = list(range(dense_nodes))
+    t_dij, by_dijkstra = timed(dense.distance_matrix, nodes, method='dijkstra')
+    t_fw, by_fw = timed(dense.distance_matrix, nodes, method='floyd_warshall')
+    assert np.allclose(by_dijkstra, by_fw)
+    rows.append(('dense', 'dijkstra', t_dij))
+    rows.append(('dense', 'floyd_warshall', t_fw))
+    print("distance_matrix complete graph %d nodes  dijkstra: %7.3fs  floyd-warshall: %7.3fs" % (dense_nodes, t_dij, t_fw))
+    return rows
+
+def bench_tour(seed=0, n_samples=2000, k=10, exact_sizes=(8, 12), sizes=(50, 200), added=5, time_budget=2.0):
+    """Goal ordering on denali PRM distance matrices: Held-Karp against
+    local search on small goal sets (optimality gap), nearest neighbour
+    against local search on large ones, then re-solving after adding goals
+    from the previous order against from scratch."""
+    rows = []
+    env = Environment('denali.yaml')
+    graph = PRM(env, n_samples, k, seed=seed).roadmap
+    nodes = sorted(graph._nodes)
+    rng = random.Random(seed)
+    for n in exact_sizes:
+        dist = graph.distance_matrix(rng.sample(nodes, n + 1))
+        t_exact, (_, exact) = timed(held_karp, dist)
+        t_local, (_, local) = timed(solve_tour, dist, exact_limit=0, time_budget=time_budget)
+        rows.append((n, t_exact, exact, t_local, local))
+        print("tour %3d goals  held-karp: %7.3fs cost %8.3f  local search: %7.3fs cost %8.3f  gap: %5.2f%%"
+              % (n, t_exact, exact, t_local, local, 100 * (local / exact - 1)))
+    for n in sizes:
+        points = rng.sample(nodes, n + 1 + added)
+        dist = graph.distance_matrix(points)
+        small = dist[:n + 1, :n + 1]
+        greedy = tour_cost(small, nearest_neighbor_tour(small), False)
+        t_local, (order, local) = timed(solve_tour, small, time_budget=time_budget)
+        t_warm, (_, warm) = timed(solve_tour, dist, time_budget=time_budget, initial=order)
+        t_cold, (_, cold) = timed(solve_tour, dist, time_budget=time_budget)
+        rows.append((n, greedy, t_local, local, t_warm, warm, t_cold, cold))
+        print("tour %3d goals  nearest neighbour cost %8.3f  local search: %7.3fs cost %8.3f  "
+              "+%d goals warm: %7.3fs cost %8.3f  cold: %7.3fs cost %8.3f"
+              % (n, greedy, t_local, local, added, t_warm, warm, t_cold, cold))
+    return rows
+
+def _visibility_edges(vg):
+    return set((a, b) for a in vg.graph._nodes for b, _ in vg.graph.neighbors(a) if a < b)
+
+
+def bench_visibility_graph(scenes=('simple.yaml', 'denali.yaml'), changes=8, max_distance=3.0, seed=0):
+    """VisibilityGraph.add_obstacle and remove_obstacle against building
+    the graph from scratch: changes obstacles of each scene are taken out
+    and added back one at a time, then removed again. After every step
+    the incremental graph must have the same edges as a full rebuild."""
+    rng = random.Random(seed)
+    rows = []
+    for scene in scenes:
+        obstacles = Environment(scene).expanded_obstacles
+        moving = rng.sample(range(len(obstacles)), min(changes, len(obstacles)))
+        fixed = [p for i, p in enumerate(obstacles) if i not in moving]
+        vg = VisibilityGraph(fixed, max_distance=max_distance)
+        present = list(fixed)
+        steps = [('add', i) for i in moving] + [('remove', i) for i in moving]
+        ids = {}
+        t_incremental = t_rebuild = 0.0
+        for op, i in steps:
+            if op == 'add':
+                t, ids[i] = timed(vg.add_obstacle, obstacles[i])
+                present.append(obstacles[i])
+            else:
+                t, _ = timed(vg.remove_obstacle, ids[i])
+                present.remove(obstacles[i])
+            t_incremental += t
+            t, rebuilt = timed(VisibilityGraph, present, max_distance=max_distance)
+            t_rebuild += t
+            if _visibility_edges(vg) != _visibility_edges(rebuilt) or \
+                    set(vg.graph._nodes) != set(rebuilt.graph._nodes):
+                raise Exception("Incremental visibility graph of %s differs from a rebuild after %s %d"
+                                % (scene, op, i))
+        rows.append((scene, len(steps), t_incremental, t_rebuild))
+        print("visibility_graph %-16s %d changes  incremental: %7.3fs  rebuild each time: %7.3fs  speedup: %5.1fx"
+              % (scene, len(steps), t_incremental, t_rebuild, t_rebuild / t_incremental))
+    return rows
+
+def bench_replanning(seed=0, n_samples=3000, k=10, sense_every=3, lookahead=4, radius=0.25, max_steps=200):
+    """A robot walking a PRM roadmap of each bundled scene, replanning after
+    every step; every sense_every steps an obstacle of the given radius
+    appears lookahead nodes ahead of it. D* Lite repairs its search, A*
+    starts over on the same roadmap; both must agree on every cost."""
+    rows = []
+    for scene, (start, goal) in sorted(SCENE_QUERIES.items()):
+        env = Environment(scene)
+        prm = PRM(env, n_samples, k, seed=seed)
+        start, goal = prm.connect(start), prm.connect(goal)
+        if start is None or goal is None:
+            continue
+        planner = DStarLite(prm.roadmap, start, goal, euclidean_heuristic)
+        t_inc, path = timed(planner.plan)
+        t_scratch, steps, sensed = 0.0, 0, 0
+        while path is not None and len(path.path) > 1 and steps < max_steps:
+            steps += 1
+            if steps % sense_every == 0 and len(path.path) > lookahead + 2:
+                t, _ = timed(planner.add_obstacle, Point(path.path[lookahead]).buffer(radius))
+                t_inc += t
+                sensed += 1
+            planner.move_to(path.path[1])
+            t, path = timed(planner.plan)
+            t_inc += t
+            t, fresh = timed(astar_search, prm.roadmap, planner.start, goal, euclidean_heuristic)
+            t_scratch += t
+            assert (path is None) == (fresh is None)
+            assert path is None or abs(path.cost - fresh.cost) < 1e-9
+        rows.append((scene, steps, sensed, t_inc, t_scratch))
+        print("replanning %-16s steps: %3d  obstacles: %3d  D* Lite: %7.3fs  A* from scratch: %7.3fs  speedup: %4.1fx"
+              % (scene, steps, sensed, t_inc, t_scratch, t_scratch / t_inc))
+    return rows
+
+# The layout used to generate the Denali scenes.
+DENALI_LAYOUT = dict(
+    bounds=(-5, -4, 15, 5), start=(-4, -2), radius=0.1,
+    goals=(Polygon([(12, 3), (12, 4), (13, 4), (13, 3)]), Polygon([(-4.5, 4), (-3.5, 4), (-3.5, 3.5), (-4.5, 3.5)]),
+           Polygon([(9.5, 0), (9.5, 0.5), (10, 0.5), (10, 0)]), Polygon([(14, -3.5), (14, -3), (14.5, -3), (14.5, -3.5)])),
+    size_limits=(0.45, 0.45))
+
+
+def bench_batch_planning(scene='denali.yaml', n_queries=2000, n_samples=2000, k=10, naive_queries=5,
+                         processes=None, seed=0):
+    """Query throughput of BatchPlanner against loading the scene and
+    building a roadmap for every query, for 1, 2, 4, ... up to processes
+    workers (default: the CPU count, at least 2), with the speedup over
+    one worker, then the same batch again from the cache."""
+    rng = np.random.default_rng(seed)
+    env = Environment(scene)
+    points = sample_free(env, 2 * n_queries, rng)
+    queries = [(tuple(points[2*i]), tuple(points[2*i+1])) for i in range(n_queries)]
+    t, _ = timed(lambda: [PRM(Environment(scene), n_samples, k, seed=seed).query(s, g)
+                          for s, g in queries[:naive_queries]])
+    print("batch_planning %s  reload per query: %8.1f queries/s" % (scene, naive_queries / t))
+    most = max(2, processes or os.cpu_count() or 1)
+    counts = sorted(set([2 ** i for i in range(most.bit_length()) if 2 ** i <= most] + [most]))
+    t_one = None
+    for n in counts:
+        with BatchPlanner(env, n_samples, k, seed=seed, processes=n) as planner:
+            t_setup, _ = timed(planner._build)
+            t_batch, paths = timed(planner.plan_all, queries)
+            t_cached, _ = timed(planner.plan_all, queries)
+        t_one = t_one or t_batch
+        print("batch_planning %s  processes=%d  setup: %.3fs  %8.1f queries/s  (%d paths)  scaling: %4.2fx  "
+              "cached: %8.1f queries/s"
+              % (scene, n, t_setup, n_queries / t_batch, sum(p is not None for p in paths), t_one / t_batch,
+                 n_queries / t_cached))
+    print("batch_planning %s  CPUs: %d" % (scene, os.cpu_count() or 1))
+
+
+def bench_random_environment(sizes=(1000, 10000), seed=0):
+    """random_environment against generate_random_environment, then writing
+    the generated scene out as YAML and as a compiled environment."""
+    rows = []
+    out = tempfile.mkdtemp()
+    try:
+        for n in sizes:
+            np.random.seed(seed)
+            t_old, _ = timed(random_environment, n=n, **DENALI_LAYOUT)
+            t_new, env = timed(generate_random_environment, n=n, seed=seed, **DENALI_LAYOUT)
+            t_yaml, _ = timed(env.save_to_yaml, os.path.join(out, 'random_%d.yaml' % n))
+            t_bin, _ = timed(env.save_to_binary, os.path.join(out, 'random_%d.envbin' % n))
+            rows.append((n, t_old, t_new, t_yaml, t_bin))
+            print("random_environment n=%6d  loop: %7.3fs  batched: %7.3fs  speedup: %5.1fx  "
+                  "write yaml: %7.3fs  write binary: %7.3fs" % (n, t_old, t_new, t_old / t_new, t_yaml, t_bin))
+    finally:
+        shutil.rmtree(out)
+    return rows
+
+
+def permutation_polygon(points):
+    """parse_polygon as it was: try corner orders until one is valid."""
+    for order in itertools.permutations(points):
+        polygon = Polygon(order)
+        if polygon.is_valid:
+            return polygon
+
+
+def _shuffled_polygon(n, rng):
+    """n corners of a random star-shaped polygon, in random order."""
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    radii = rng.uniform(0.5, 1.0, n)
+    corners = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+    rng.shuffle(corners)
+    return corners.tolist()
+
+
+def _stream_obstacles(text):
+    return list(ObstacleStream(io.StringIO(text)))
+
+
+def bench_polygon_ingestion(sizes=(5, 6, 7, 8, 9), polygons=5, large=(100, 1000),
+                            scenes=('denali.yaml', 'Denali_650.yaml'), random_size=2000, seed=0):
+    """Fixing the corner order of shuffled polygons by trying permutations
+    (the old parse_polygon) against repair_polygon, then reading the
+    obstacles of a scene with yaml.safe_load against ObstacleStream. The
+    peak memory compares holding the whole document with streaming through
+    it."""
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        cases = [_shuffled_polygon(n, rng) for _ in range(polygons)]
+        t_old, _ = timed(lambda: [permutation_polygon(c) for c in cases])
+        t_new, _ = timed(lambda: [repair_polygon(c) for c in cases])
+        print("polygon_ingestion corners=%5d  permutations: %8.4fs  repair: %8.4fs  speedup: %7.1fx"
+              % (n, t_old / polygons, t_new / polygons, t_old / t_new))
+    for n in large:
+        cases = [_shuffled_polygon(n, rng) for _ in range(polygons)]
+        t_new, _ = timed(lambda: [repair_polygon(c) for c in cases])
+        print("polygon_ingestion corners=%5d  repair: %8.4fs" % (n, t_new / polygons))
+    out = tempfile.mkdtemp()
+    try:
+        random_file = os.path.join(out, 'random_%d.yaml' % random_size)
+        generate_random_environment(n=random_size, seed=seed, **DENALI_LAYOUT).save_to_yaml(random_file)
+        for scene in list(scenes) + [random_file]:
+            with open(scene) as f:
+                text = f.read()
+            t_old, _ = timed(yaml.safe_load, text)
+            t_new, _ = timed(_stream_obstacles, text)
+            peaks = []
+            for fn in (yaml.safe_load, lambda text: all(True for _ in ObstacleStream(io.StringIO(text)))):
+                tracemalloc.start()
+                fn(text)
+                peaks.append(tracemalloc.get_traced_memory()[1] / 1e6)
+                tracemalloc.stop()
+            print("polygon_ingestion %-16s safe_load: %6.3fs  stream: %6.3fs  speedup: %4.1fx  "
+                  "peak memory: %6.1fMB document, %5.2fMB one obstacle at a time"
+                  % (os.path.basename(scene), t_old, t_new, t_old / t_new, peaks[0], peaks[1]))
+    finally:
+        shutil.rmtree(out)
+
+
+def bench_cspace(scenes=('denali.yaml', 'Denali_650.yaml'), random_size=2000, radii=(0.2, 0.5, 0.75),
+                 n_segments=20000, seed=0):
+    """Environment.cspace per robot radius: buffering and indexing on first
+    use (which also updates the compiled copy), a repeated call, and a
+    fresh load of the scene that finds it in the compiled copy. Then the
+    merged configuration space against the per-obstacle one for batched
+    segment checks."""
+    out = tempfile.mkdtemp()
+    try:
+        files = []
+        for scene in scenes:
+            files.append(shutil.copy(scene, out))
+        random_file = os.path.join(out, 'random_%d.yaml' % random_size)
+        generate_random_environment(n=random_size, seed=seed, **DENALI_LAYOUT).save_to_yaml(random_file)
+        files.append(random_file)
+        rng = np.random.default_rng(seed)
+        for yaml_file in files:
+            label = os.path.basename(yaml_file)
+            env = Environment(yaml_file)
+            for radius in radii:
+                t_first, _ = timed(env.cspace, radius)
+                t_again, _ = timed(env.cspace, radius)
+                t_load, _ = timed(lambda: Environment(yaml_file).cspace(radius))
+                t_switch, _ = timed(env.set_robot_radius, radius)
+                print("cspace %-16s radius=%.3f  first: %6.3fs  memoised: %8.2gs  persisted load: %6.3fs  "
+                      "(load alone %6.3fs)  switch: %8.2gs"
+                      % (label, radius, t_first, t_again, t_load, timed(Environment, yaml_file)[0], t_switch))
+            minx, miny, maxx, maxy = env.bounds
+            a = rng.uniform((minx, miny), (maxx, maxy), size=(n_segments, 2))
+            b = a + rng.uniform(-1, 1, size=(n_segments, 2))
+            for radius in radii:
+                polygons, index = env.cspace(radius)
+                t_merge, (merged, merged_index) = timed(env.cspace, radius, True)
+                t_plain, hits = timed(index.intersects_segments, a, b)
+                t_merged, merged_hits = timed(merged_index.intersects_segments, a, b)
+                if not np.array_equal(hits, merged_hits):
+                    raise Exception("Merged configuration space disagrees at radius %r" % radius)
+                print("cspace %-16s radius=%.3f  polygons: %5d -> %5d merged (%.3fs)  "
+                      "%d segment checks: %6.3fs -> %6.3fs"
+                      % (label, radius, len(polygons), len(merged), t_merge, n_segments, t_plain, t_merged))
+            # Obstacles edited in memory must not reach the compiled copy.
+            edited = Environment(yaml_file)
+            edited.add_obstacles([Point(edited.bounds[:2]).buffer(0.5)])
+            edited.cspace(radii[0] / 2)
+            if len(Environment(yaml_file).obstacles) != len(Environment(yaml_file, use_cache=False).obstacles):
+                raise Exception("cspace saved edited obstacles over the compiled copy of %s" % label)
+    finally:
+        shutil.rmtree(out)
+
+
+def patch_per_obstacle_png(filename, env):
+    """plot_environment as it was: one descartes PolygonPatch per obstacle."""
+    from descartes import PolygonPatch
+    from matplotlib import pyplot as plt
+    f = plt.figure(figsize=(12, 6))
+    ax = f.add_subplot(111)
+    for obs in env.obstacles:
+        ax.add_patch(PolygonPatch(obs, fc='blue', ec='blue', alpha=0.5, zorder=20))
+    minx, miny, maxx, maxy = env.bounds
+    ax.set_xlim(minx, maxx)
+    ax.set_ylim(miny, maxy)
+    f.savefig(filename)
+    plt.close(f)
+
+
+def networkx_png(filename, graph):
+    """Graph.draw as it was (every node and edge label), saved to a file."""
+    import matplotlib
+    from matplotlib import pyplot as plt
+    from visualization import draw_graph
+    backend = matplotlib.get_backend()
+    plt.switch_backend('Agg')
+    try:
+        draw_graph(graph, label_limit=float('inf'))
+        plt.savefig(filename)
+        plt.close('all')
+    finally:
+        plt.switch_backend(backend)
+
+
+def bench_rendering(random_size=5000, n_samples=3000, small_samples=300, k=10, n_paths=20, seed=0):
+    """Writing PNGs: obstacles one patch each against render_png's single
+    collection (Denali_650 and a random scene), networkx drawing against
+    render_png for a small roadmap, and render_png for a big roadmap with
+    n_paths paths in one image."""
+    from visualization import render_png
+    rows = []
+    out = tempfile.mkdtemp()
+    try:
+        scenes = [('Denali_650.yaml', Environment('Denali_650.yaml')),
+                  ('random_%d' % random_size,
+                   generate_random_environment(n=random_size, seed=seed, **DENALI_LAYOUT))]
+        for label, env in scenes:
+            t_old, _ = timed(patch_per_obstacle_png, os.path.join(out, 'old.png'), env)
+            t_new, _ = timed(render_png, os.path.join(out, 'new.png'), env)
+            rows.append((label, len(env.obstacles), t_old, t_new))
+            print("rendering %-16s %5d obstacles  patch each: %7.3fs  render_png: %7.3fs  speedup: %4.1fx"
+                  % (label, len(env.obstacles), t_old, t_new, t_old / t_new))
+        env = Environment('denali.yaml')
+        small = PRM(env, small_samples, k, seed=seed).roadmap
+        t_old, _ = timed(networkx_png, os.path.join(out, 'old_graph.png'), small)
+        t_new, _ = timed(render_png, os.path.join(out, 'new_graph.png'), env, small)
+        rows.append(('roadmap_%d' % small_samples, t_old, t_new))
+        print("rendering roadmap %4d nodes  networkx with labels: %7.3fs  render_png: %7.3fs  speedup: %4.1fx"
+              % (small_samples, t_old, t_new, t_old / t_new))
+        prm = PRM(env, n_samples, k, seed=seed)
+        rng = np.random.default_rng(seed)
+        start = SCENE_QUERIES['denali.yaml'][0]
+        goals = prm.points[rng.choice(len(prm.points), n_paths, replace=False)]
+        paths = [prm.query(start, goal) for goal in goals]
+        paths = [p for p in paths if p is not None]
+        t, edges = timed(render_png, os.path.join(out, 'paths.png'), env, prm.roadmap, paths)
+        rows.append(('roadmap_%d' % n_samples, edges, len(paths), t))
+        print("rendering roadmap %4d nodes  %d edges and %d paths in one image: %7.3fs"
+              % (n_samples, edges, len(paths), t))
+    finally:
+        shutil.rmtree(out)
+    return rows
+
+def random_fault_model(n, modes=2, seed=0):
+    """n components, each with a likely nominal mode and unlikely faults."""
+    rng = random.Random(seed)
+    components, mode_probs = {}, {}
+    for i in range(n):
+        weights = [rng.uniform(5, 20)] + [rng.random() for _ in range(modes - 1)]
+        total = sum(weights)
+        components['component_%d' % i] = ['nominal'] + ['fault_%d' % j for j in range(1, modes)]
+        mode_probs['component_%d' % i] = [w / total for w in weights]
+    return components, mode_probs
+
+
+def _first_k(candidates, k):
+    return [c for c, _ in zip(candidates, range(k))]
+
+
+def bench_candidate_generation(sizes=(8, 12, 16, 18, 40), k=100, eager_limit=18):
+    """Time and peak memory to get the k most likely assignments, eagerly
+    with probability_queue and lazily with best_first_assignments, as the
+    number of (two-mode) components grows."""
+    rows = []
+    for n in sizes:
+        components, mode_probs = random_fault_model(n)
+        results = {}
+        variants = [('lazy', lambda: _first_k(best_first_assignments(components, mode_probs), k))]
+        if n <= eager_limit:
+            variants.insert(0, ('eager', lambda: _first_k(probability_queue(components, mode_probs).values(), k)))
+        for label, run in variants:
+            tracemalloc.start()
+            t, first = timed(run)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[label] = first
+            rows.append((n, label, t, peak))
+            print("candidate_generation n=%2d %-5s first %d of %d: %8.4fs  peak memory: %9.1f KB"
+                  % (n, label, k, 2 ** n, t, peak / 1e3))
+        if 'eager' in results:
+            assert [p for p, _ in results['eager']] == [p for p, _ in results['lazy']]
+    return rows
+
+
+def symptom_constraints(components, n_symptoms, group_size, seed=0):
+    """Observed symptoms, each saying some component of a random group of
+    group_size is not in its nominal mode."""
+    rng = random.Random(seed)
+    constraints = []
+    for s in range(n_symptoms):
+        group = rng.sample(sorted(components), group_size)
+        constraints.append(Constraint(group, lambda a, group=group: any(a[c] != 'nominal' for c in group),
+                                      name='symptom_%d' % s))
+    return constraints
+
+
+def bench_conflict_directed(cases=((20, 2), (20, 3), (30, 4), (40, 5)), group_size=4, k=5, modes=3):
+    """Best-first generate-and-test against conflict-directed A* for the k
+    most likely diagnoses of models with n components and a number of
+    symptoms."""
+    rows = []
+    for n, n_symptoms in cases:
+        components, mode_probs = random_fault_model(n, modes)
+        constraints = symptom_constraints(components, n_symptoms, group_size)
+        tested = [0]
+        def counting(c):
+            def check(a):
+                tested[0] += 1
+                return c(a)
+            return check
+        t_gt, gt = timed(constraint_based_astar, components, mode_probs,
+                         [counting(constraints[0])] + constraints[1:], k)
+        t_cd, (cd, stats) = timed(conflict_directed_astar, components, mode_probs, constraints, k)
+        assert [round(p, 15) for p, _ in gt] == [round(p, 15) for p, _ in cd]
+        rows.append((n, n_symptoms, t_gt, tested[0], t_cd, stats))
+        print("conflict_directed n=%2d symptoms=%d  generate-and-test: %8.4fs %8d candidates  "
+              "CDA*: %8.4fs %5d candidates, %5d expanded, %5d pruned, %3d conflicts, %5d evaluations"
+              % (n, n_symptoms, t_gt, tested[0], t_cd, stats['tested'], stats['expanded'], stats['pruned'],
+                 stats['conflicts'], stats['evaluations']))
+    return rows
+
+
+
+# Modules a headless planner imports, the plotting stack they must not pull
+# in, and how long importing them may take in a fresh interpreter.
+CORE_MODULES = ('batch_planning', 'constraint_astar', 'environment', 'graph', 'incremental_search',
+                'occupancy_grid', 'sampling_planners', 'search', 'search_classes', 'tour', 'utils',
+                'visibility_graph')
+PLOTTING_MODULES = ('matplotlib', 'descartes', 'networkx', 'pydot_ng')
+IMPORT_BUDGET = 0.5
+
+
+def core_import_time(repeat=5):
+    """Seconds (best of repeat fresh interpreters) to import CORE_MODULES,
+    and the PLOTTING_MODULES that got imported along the way."""
+    import subprocess
+    code = ("import sys, time; t = time.perf_counter(); import %s; t = time.perf_counter() - t; "
+            "print(t, ' '.join(m for m in %r if m in sys.modules))" % (", ".join(CORE_MODULES), PLOTTING_MODULES))
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=here, universal_newlines=True).split()
+        runs.append((float(out[0]), out[1:]))
+    return min(runs)
+
+
+def bench_imports(repeat=5, budget=IMPORT_BUDGET):
+    """Import time of the planning modules in a fresh interpreter. Fails if
+    that loads the plotting stack or takes longer than budget seconds."""
+    t, plotting = core_import_time(repeat)
+    print("imports %d core modules: %.3fs (budget %.3fs)  plotting modules loaded: %s"
+          % (len(CORE_MODULES), t, budget, ", ".join(plotting) or "none"))
+    if plotting:
+        raise Exception("Importing the core loaded %s" % ", ".join(plotting))
+    if t > budget:
+        raise Exception("Importing the core took %.3fs, over the %.3fs budget" % (t, budget))
+    return {'core': t}
+
+def best_of(repeat, fn, *args, **kwargs):
+    """Return (seconds, result) of the fastest of repeat calls."""
+    runs = [timed(fn, *args, **kwargs) for _ in range(repeat)]
+    return min(t for t, _ in runs), runs[-1][1]
+
+
+def _parse_shapes(env, obstacles):
+    shapes = []
+    for name, description in obstacles.items():
+        if description['shape'] == 'rectangle':
+            shapes.append(env.parse_rectangle(name, description))
+        else:
+            shapes.append(env.parse_polygon(name, description))
+    return shapes
+
+
+def _pool_path(states):
+    pool = NodePool()
+    i = -1
+    for state in states:
+        i = pool.add(state, i)
+    return pool, i
+
+
+def stage_timings(yaml_file, start, goal, n_samples=1000, k=10, seed=0, repeat=3):
+    """Seconds (best of repeat) spent in each stage of planning on a scene:
+    YAML parsing, building the obstacle shapes, buffering them into
+    expanded_obstacles, building the collision index, loading the compiled
+    environment, building a PRM roadmap, searching it and reconstructing
+    the path."""
+    times = {}
+    with open(yaml_file) as f:
+        text = f.read()
+    times['yaml_parse'], obstacles = best_of(repeat, _stream_obstacles, text)
+    env = Environment(bounds=(0, 0, 1, 1))
+    obstacles = dict(obstacles)
+    times['obstacle_parse'], shapes = best_of(repeat, _parse_shapes, env, obstacles)
+    times['buffering'], expanded = best_of(repeat, env.expand_obstacles, shapes)
+    env.obstacles, env.expanded_obstacles = shapes, expanded
+    times['index_build'], _ = best_of(repeat, env.build_index)
+    Environment(yaml_file)  # Make sure the compiled copy exists.
+    times['binary_load'], env = best_of(repeat, Environment, yaml_file)
+    times['graph_build'], prm = best_of(repeat, PRM, env, n_samples, k, seed=seed)
+    start, goal = prm.connect(start), prm.connect(goal)
+    path = None
+    if start is not None and goal is not None:
+        times['search'], path = best_of(repeat, astar_search, prm.roadmap, start, goal, euclidean_heuristic)
+    if path is not None:
+        pool, last = _pool_path(path.path)
+        number = 1000
+        t, _ = best_of(repeat, lambda: [Path.from_pool(pool, last) for _ in range(number)])
+        times['path_reconstruction'] = t / number
+    return times
+
+
+def bench_stages(scenes=tuple(sorted(SCENE_QUERIES)), random_sizes=(50, 200, 800), seed=0, repeat=3,
+                 n_samples=1000, queue_size=20000):
+    """stage_timings for the bundled scenes and for seeded random scenes of
+    growing size (laid out like Denali), plus the core import time and the
+    PriorityQueue frontier workload. Returns a flat {"scene/stage": seconds} dict; scenes whose
+    query has no path have no search or path_reconstruction entry."""
+    results = {}
+    out = tempfile.mkdtemp()
+    try:
+        cases = [(scene, scene) + SCENE_QUERIES[scene] for scene in scenes]
+        goal = DENALI_LAYOUT['goals'][0].centroid.coords[0]
+        for n in random_sizes:
+            yaml_file = os.path.join(out, 'random_%d.yaml' % n)
+            generate_random_environment(n=n, seed=seed, **DENALI_LAYOUT).save_to_yaml(yaml_file)
+            cases.append(('random_%d' % n, yaml_file, DENALI_LAYOUT['start'], goal))
+        for label, yaml_file, start, goal in cases:
+            times = stage_timings(yaml_file, start, goal, n_samples, seed=seed, repeat=repeat)
+            for stage, t in times.items():
+                results['%s/%s' % (label, stage)] = t
+            print("stages %-16s %s" % (label, "  ".join("%s: %.3gs" % item for item in times.items())))
+    finally:
+        shutil.rmtree(out)
+    results['imports/core'], _ = core_import_time()
+    print("stages imports           core: %.3gs" % results['imports/core'])
+    results['priority_queue/frontier_%d' % queue_size], _ = best_of(repeat, _frontier_workload, PriorityQueue,
+                                                                   queue_size, seed)
+    print("stages priority_queue     frontier n=%d: %.3gs" % (queue_size, results['priority_queue/frontier_%d' % queue_size]))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, noise=1e-3):
+    """Regressions of results against baseline (both {key: seconds}): keys
+    slower by more than the tolerance fraction and by more than noise
+    seconds, as (key, baseline seconds, seconds) tuples."""
+    slower = []
+    for key in sorted(set(results) & set(baseline)):
+        before, after = baseline[key], results[key]
+        if after > before * (1 + tolerance) and after - before > noise:
+            slower.append((key, before, after))
+    return slower
+
+BENCHMARKS = {
+    'priority_queue': bench_priority_queue,
+    'batch_planning': bench_batch_planning,
+    'candidate_generation': bench_candidate_generation,
+    'collision': bench_collision,
+    'conflict_directed': bench_conflict_directed,
+    'cspace': bench_cspace,
+    'distance_matrix': bench_distance_matrix,
+    'imports': bench_imports,
+    'instrumentation': bench_instrumentation,
+    'node_storage': bench_node_storage,
+    'polygon_ingestion': bench_polygon_ingestion,
+    'random_environment': bench_random_environment,
+    'rendering': bench_rendering,
+    'replanning': bench_replanning,
+    'sampling_planners': bench_sampling_planners,
+    'stages': bench_stages,
+    'tour': bench_tour,
+    'visibility_graph': bench_visibility_graph,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help="benchmarks to run, from %s (default: all)" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--json', metavar='path', help="write the results to this JSON file")
+    parser.add_argument('--baseline', metavar='path',
+                        help="JSON file written by an earlier --json run to compare the stages against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="fraction a stage may be slower than its baseline (default: %(default)s)")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+    results = {}
+    for name in args.names or sorted(BENCHMARKS):
+        results[name] = BENCHMARKS[name]()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'results': results}, f, indent=1, sort_keys=True, default=float)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results'].get('stages', {})
+        if 'stages' not in results:
+            parser.error("--baseline compares the stages benchmark; include it in the names")
+        slower = compare_to_baseline(results['stages'], baseline, args.tolerance)
+        for key, before, after in slower:
+            print("SLOWER %-40s %9.4fs -> %9.4fs (%+.0f%%)" % (key, before, after, 100 * (after / before - 1)))
+        print("%d of %d stages slower than the baseline" % (len(slower), len(set(results['stages']) & set(baseline))))
+        if slower:
+            sys.exit(1)
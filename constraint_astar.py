@@ -0,0 +1,278 @@
+"""Constraint-based A* over mode assignments of an equipment model.
+
+components maps each component to its list of modes and mode_probs maps it
+to the matching prior probabilities:
+
+    components = {component_1: [modeA, modeB, ...], ...}
+    mode_probs = {component_1: [P(modeA), P(modeB), ...], ...}
+
+A complete assignment is a dict component -> mode; its prior is the product
+of the chosen modes' probabilities.
+"""
+import heapq
+import itertools
+import math
+
+
+def assignment_probability(assignment, components, mode_probs):
+    p = 1.0
+    for c, mode in assignment.items():
+        p *= mode_probs[c][components[c].index(mode)]
+    return p
+
+
+def probability_queue(components, mode_probs):
+    """Eager candidate generator: every complete assignment, ordered by prior.
+
+    Returns prob_ordered_dictionary, whose keys are 0, 1, ... in order of
+    decreasing prior probability and whose values are (probability,
+    assignment) pairs. This materialises all prod(len(modes)) assignments;
+    best_first_assignments produces the same sequence lazily."""
+    names = list(components)
+    candidates = []
+    for modes in itertools.product(*[list(zip(components[c], mode_probs[c])) for c in names]):
+        p = 1.0
+        for _, pm in modes:
+            p *= pm
+        candidates.append((p, dict(zip(names, [m for m, _ in modes]))))
+    candidates.sort(key=lambda x: -x[0])
+    return dict(enumerate(candidates))
+
+
+def best_first_assignments(components, mode_probs):
+    """Lazily yield (probability, assignment) for every complete assignment in
+    order of decreasing prior probability.
+
+    Each component's modes are ranked by probability, so an assignment is a
+    vector of ranks and the all-zero vector is the most likely one. The heap
+    holds rank vectors keyed on their exact -log prior; popping one pushes
+    the vectors that bump a single rank at or after the position bumped last,
+    which reaches every vector exactly once and never yields a more likely
+    one later. Memory grows with the number of assignments yielded, not with
+    the size of the assignment space."""
+    names = list(components)
+    ranked = []
+    for c in names:
+        order = sorted(range(len(components[c])), key=lambda i: -mode_probs[c][i])
+        ranked.append([(components[c][i], mode_probs[c][i]) for i in order])
+    if any(not modes for modes in ranked):
+        return
+
+    def cost(p):
+        return -math.log(p) if p > 0 else math.inf
+
+    costs = [[cost(p) for _, p in modes] for modes in ranked]
+    counter = itertools.count()
+    ranks = (0,) * len(names)
+    heap = [(sum(c[0] for c in costs), next(counter), ranks, 0)]
+    while heap:
+        _, _, ranks, last = heapq.heappop(heap)
+        assignment = {}
+        p = 1.0
+        for c, modes, r in zip(names, ranked, ranks):
+            mode, pm = modes[r]
+            assignment[c] = mode
+            p *= pm
+        yield p, assignment
+        for i in range(last, len(names)):
+            r = ranks[i] + 1
+            if r < len(ranked[i]):
+                child = ranks[:i] + (r,) + ranks[i+1:]
+                child_cost = sum(cs[ri] for cs, ri in zip(costs, child))
+                heapq.heappush(heap, (child_cost, next(counter), child, i))
+
+
+def consistent(assignment, constraints):
+    """True if assignment satisfies every constraint (callables taking the
+    assignment and returning a bool)."""
+    for constraint in constraints:
+        if not constraint(assignment):
+            return False
+    return True
+
+
+def constraint_based_astar(components, mode_probs, constraints, k=1):
+    """Test candidates in order of prior probability and return the first k
+    consistent (probability, assignment) pairs; candidates beyond them are
+    never generated."""
+    found = []
+    if k <= 0:
+        return found
+    for p, assignment in best_first_assignments(components, mode_probs):
+        if consistent(assignment, constraints):
+            found.append((p, assignment))
+            if len(found) == k:
+                break
+    return found
+
+
+class Constraint(object):
+    """A propositional constraint over the components in scope.
+    predicate receives a dict holding the modes of (at least) those
+    components. Calling a Constraint on a complete assignment evaluates it,
+    so it can be used anywhere a plain callable constraint can."""
+    def __init__(self, scope, predicate, name=None):
+        self.scope = tuple(scope)
+        self.predicate = predicate
+        self.name = name
+
+    def __call__(self, assignment):
+        return self.predicate(assignment)
+
+    def __repr__(self):
+        return "Constraint(%s)" % (self.name or ", ".join(map(str, self.scope)))
+
+
+class ConflictDirectedAStar(object):
+    """Conflict-directed A* diagnosis engine.
+
+    Search nodes are partial assignments ordered by an admissible bound: the
+    prior of the assigned modes times the most likely mode of every other
+    component. A node that resolves every known conflict (differs from each
+    on some component) is completed with those most likely modes and tested.
+    A failed test yields a conflict -- the failing constraint's view of the
+    candidate, shrunk by dropping components whose every mode still fails --
+    and nodes are only ever expanded by the constituent kernels of an
+    unresolved conflict, so the search jumps straight to candidates that
+    resolve all conflicts found so far (kernel diagnoses). Each consistent
+    candidate found is added as a nogood, which makes solutions() enumerate
+    consistent assignments in decreasing prior probability.
+
+    Constraint evaluations are cached on the modes of the constraint's
+    scope, so a partial assignment is never checked twice against the same
+    constraint. stats counts nodes expanded, children pruned (duplicates and
+    zero-prior), candidates tested, conflicts learned, constraint
+    evaluations and cache hits."""
+    max_minimize_completions = 256
+
+    def __init__(self, components, mode_probs, constraints):
+        self.components = components
+        self.mode_probs = mode_probs
+        self.names = list(components)
+        self.constraints = [c if isinstance(c, Constraint) else Constraint(self.names, c)
+                            for c in constraints]
+        self.prob = {c: dict(zip(components[c], mode_probs[c])) for c in self.names}
+        self.best_mode = {c: max(components[c], key=self.prob[c].get) for c in self.names if components[c]}
+        self.conflicts = []
+        self.cache = {}
+        self.stats = dict(expanded=0, pruned=0, tested=0, conflicts=0, evaluations=0, cache_hits=0)
+
+    def _evaluate(self, i, assignment):
+        constraint = self.constraints[i]
+        key = (i, tuple(assignment[c] for c in constraint.scope))
+        result = self.cache.get(key)
+        if result is None:
+            self.stats['evaluations'] += 1
+            result = self.cache[key] = bool(constraint(assignment))
+        else:
+            self.stats['cache_hits'] += 1
+        return result
+
+    def _fails_everywhere(self, i, fixed, free):
+        """True if constraint i fails for every assignment of the components
+        in free, with the rest of its scope set as in fixed."""
+        completion = dict(fixed)
+        for modes in itertools.product(*[self.components[c] for c in free]):
+            completion.update(zip(free, modes))
+            if self._evaluate(i, completion):
+                return False
+        return True
+
+    def _conflict(self, i, candidate):
+        """Minimal conflict explaining why candidate violates constraint i."""
+        scope = self.constraints[i].scope
+        kept = list(scope)
+        free = []
+        for c in scope:
+            trial_free = free + [c]
+            size = 1
+            for f in trial_free:
+                size *= len(self.components[f])
+            if size > self.max_minimize_completions:
+                continue
+            trial_kept = [k for k in kept if k != c]
+            fixed = dict((k, candidate[k]) for k in trial_kept)
+            if self._fails_everywhere(i, fixed, trial_free):
+                kept, free = trial_kept, trial_free
+        return dict((c, candidate[c]) for c in kept)
+
+    def _bound(self, partial):
+        p = 1.0
+        for c in self.names:
+            p *= self.prob[c][partial[c]] if c in partial else self.prob[c][self.best_mode[c]]
+        return p
+
+    @staticmethod
+    def _resolves(partial, conflict):
+        for c, mode in conflict.items():
+            if c in partial and partial[c] != mode:
+                return True
+        return False
+
+    def _test(self, candidate):
+        """Index of a violated constraint, or None if candidate is consistent."""
+        self.stats['tested'] += 1
+        for i in range(len(self.constraints)):
+            if not self._evaluate(i, candidate):
+                return i
+        return None
+
+    def solutions(self):
+        """Yield (probability, assignment) for consistent assignments in order
+        of decreasing prior probability."""
+        if len(self.best_mode) < len(self.names):
+            return
+        counter = itertools.count()
+        root = {}
+        heap = [(-self._bound(root), next(counter), root)]
+        seen = set([frozenset()])
+        while heap:
+            neg_bound, _, partial = heapq.heappop(heap)
+            if neg_bound == 0.0:
+                return
+            conflict = None
+            for known in self.conflicts:
+                if not self._resolves(partial, known):
+                    conflict = known
+                    break
+            if conflict is None:
+                candidate = dict(self.best_mode)
+                candidate.update(partial)
+                violated = self._test(candidate)
+                if violated is None:
+                    yield -neg_bound, candidate
+                    conflict = candidate
+                else:
+                    conflict = self._conflict(violated, candidate)
+                    self.stats['conflicts'] += 1
+                self.conflicts.append(conflict)
+            # Expand by the constituent kernels of the unresolved conflict.
+            self.stats['expanded'] += 1
+            for c, mode in conflict.items():
+                if c in partial:
+                    continue
+                for other in self.components[c]:
+                    if other == mode:
+                        continue
+                    child = dict(partial)
+                    child[c] = other
+                    key = frozenset(child.items())
+                    bound = self._bound(child)
+                    if key in seen or bound == 0.0:
+                        self.stats['pruned'] += 1
+                        continue
+                    seen.add(key)
+                    heapq.heappush(heap, (-bound, next(counter), child))
+
+
+def conflict_directed_astar(components, mode_probs, constraints, k=1):
+    """The k most likely consistent (probability, assignment) pairs, found
+    with ConflictDirectedAStar. Returns (solutions, stats)."""
+    engine = ConflictDirectedAStar(components, mode_probs, constraints)
+    found = []
+    if k > 0:
+        for solution in engine.solutions():
+            found.append(solution)
+            if len(found) == k:
+                break
+    return found, engine.stats
@@ -1,60 +1,442 @@
 import yaml
+import hashlib
+import json
 import math
+import os
 
 import shapely.geometry as geom
 from shapely.geometry import Point, Polygon, LineString, box
 from shapely import affinity
-import itertools
-from matplotlib import pyplot as plt
-from descartes import PolygonPatch
+from shapely.prepared import prep
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+from shapely.validation import make_valid
 import numpy as np
 
+# libyaml's emitter when available; its output is identical but much faster.
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+try:
+    from yaml.cyaml import CParser as _YamlParser
+except ImportError:
+    from yaml.parser import Parser as _YamlParser
+    from yaml.reader import Reader
+    from yaml.scanner import Scanner
+else:
+    Reader = Scanner = None
+
+
+class _StreamLoader(_YamlParser, yaml.composer.Composer, yaml.constructor.SafeConstructor,
+                    yaml.resolver.Resolver):
+    """Safe loader (on libyaml's parser when available) whose composer we
+    drive by hand to build one obstacle at a time."""
+    def __init__(self, stream):
+        if Reader is None:
+            _YamlParser.__init__(self, stream)
+        else:
+            Reader.__init__(self, stream)
+            Scanner.__init__(self)
+            _YamlParser.__init__(self)
+        yaml.composer.Composer.__init__(self)
+        yaml.constructor.SafeConstructor.__init__(self)
+        yaml.resolver.Resolver.__init__(self)
+
+
+class ObstacleStream:
+    """(name, description) pairs of environment: obstacles: in a YAML
+    stream, parsed one obstacle at a time, so the whole document is never
+    held in memory. Everything else in the document is skipped. After
+    iterating, found says whether the document had an environment."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.found = False
+
+    def _mapping(self, loader):
+        """Yields the keys of the mapping that starts at the next event,
+        leaving each value to be consumed by the caller."""
+        if not loader.check_event(yaml.MappingStartEvent):
+            loader.compose_node(None, None)
+            return
+        loader.get_event()
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_object(loader.compose_node(None, None), deep=True)
+            yield key
+        loader.get_event()
+
+    def __iter__(self):
+        loader = _StreamLoader(self.stream)
+        try:
+            loader.get_event()
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()
+            for key in self._mapping(loader):
+                if key != 'environment':
+                    loader.compose_node(None, None)
+                    continue
+                self.found = True
+                for section in self._mapping(loader):
+                    if section != 'obstacles':
+                        loader.compose_node(None, None)
+                        continue
+                    for name in self._mapping(loader):
+                        description = loader.construct_object(loader.compose_node(None, None), deep=True)
+                        # The constructor memoises every node it builds; forget them.
+                        loader.constructed_objects = {}
+                        yield name, description
+        finally:
+            loader.dispose()
+
+
+def repair_polygon(points):
+    """A valid polygon through points and the list of repairs needed to get
+    it (empty if the points were fine as given).
+
+    Repeated consecutive corners are dropped first. If the corners are out
+    of order they are sorted by angle around their centroid, which orders
+    any star-shaped outline correctly; if that is still not valid (a
+    non-star-shaped outline, or a genuinely self-intersecting one) the
+    polygon is made valid and, if that splits it, replaced by the convex
+    hull of its corners. Each step is O(n log n) in the number of corners."""
+    repairs = []
+    corners = [tuple(p[:2]) for p in points]
+    if len(corners) > 1 and corners[0] == corners[-1]:
+        corners.pop()
+    deduped = [p for i, p in enumerate(corners) if i == 0 or p != corners[i-1]]
+    if len(deduped) != len(corners):
+        repairs.append("dropped %d repeated corners" % (len(corners) - len(deduped)))
+        corners = deduped
+    if len(corners) < 3:
+        raise Exception("A polygon needs at least 3 distinct corners, got %d" % len(corners))
+    polygon = Polygon(corners)
+    if polygon.is_valid:
+        return polygon, repairs
+    xy = np.array(corners, dtype=float)
+    center = xy.mean(axis=0)
+    order = np.argsort(np.arctan2(xy[:, 1] - center[1], xy[:, 0] - center[0]), kind='stable')
+    polygon = Polygon(xy[order])
+    repairs.append("sorted corners by angle")
+    if polygon.is_valid:
+        return polygon, repairs
+    fixed = make_valid(polygon)
+    if fixed.geom_type == 'Polygon' and not fixed.is_empty:
+        repairs.append("made valid")
+        return fixed, repairs
+    hull = geom.MultiPoint(corners).convex_hull
+    if hull.geom_type != 'Polygon':
+        raise Exception("The corners %s do not enclose any area" % (corners,))
+    repairs.append("replaced by convex hull")
+    return hull, repairs
+
 
 def plot_environment(env, bounds=None, figsize=None):
-    if bounds is None and env.bounds:
-        minx, miny, maxx, maxy = env.bounds
-    elif bounds:
-        minx, miny, maxx, maxy = bounds
-    else:
-        minx, miny, maxx, maxy = (-10,-5,10,5)
-
-    max_width, max_height = 12, 5.5
-    if figsize is None:
-        width, height = max_width, (maxy-miny)*max_width/(maxx-minx)
-        if height > 5:
-            width, height = (maxx-minx)*max_height/(maxy-miny), max_height
-        figsize = (width, height)
-    #print(figsize)
-    f = plt.figure(figsize=figsize)
-    ax = f.add_subplot(111)
-    for i, obs in enumerate(env.obstacles):
-        patch = PolygonPatch(obs, fc='blue', ec='blue', alpha=0.5, zorder=20)
-        ax.add_patch(patch)
-
-    plt.xlim([minx, maxx])
-    plt.ylim([miny, maxy])
-    ax.set_aspect('equal', adjustable='box')
-    return ax
+    from visualization import plot_environment
+    return plot_environment(env, bounds, figsize)
 
 def plot_line(ax, line):
-    x, y = line.xy
-    ax.plot(x, y, color='gray', linewidth=3, solid_capstyle='round', zorder=1)
+    from visualization import plot_line
+    plot_line(ax, line)
 
 
 def plot_poly(ax, poly, color, alpha=1.0, zorder=1):
-    patch = PolygonPatch(poly, fc=color, ec="black", alpha=alpha, zorder=zorder)
-    ax.add_patch(patch)
+    from visualization import plot_poly
+    plot_poly(ax, poly, color, alpha, zorder)
+
+def file_digest(path):
+    """sha1 of a file's contents."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def binary_cache_path(yaml_file):
+    """Where the compiled copy of yaml_file lives: next to it, as .envbin."""
+    return os.path.splitext(yaml_file)[0] + '.envbin'
+
+
+# Compiled environment layout: MAGIC, a little-endian uint64 header length,
+# a JSON header padded to 8 bytes, then the arrays listed in header['arrays']
+# back to back. Polygon p has rings polygon_rings[p]:polygon_rings[p+1] and
+# ring r has vertices coords[ring_offsets[r]:ring_offsets[r+1]], exterior
+# first. The first array set holds the obstacles, the "expanded_" one the
+# obstacles buffered by header['robot_radius'], and header['cspaces'] lists
+# [radius, merged, prefix] for further configuration spaces (see
+# Environment.cspace). header['format'] is BINARY_FORMAT; bump it whenever
+# the layout, polygon parsing/repair or buffering changes, so that files
+# compiled by older code are treated as stale and rebuilt.
+BINARY_MAGIC = b'PADMENV1'
+BINARY_FORMAT = 1
+
+def _flatten_polygons(polygons):
+    coords, ring_offsets, polygon_rings = [], [0], [0]
+    for p in polygons:
+        for ring in [p.exterior] + list(p.interiors):
+            c = np.asarray(ring.coords, dtype=np.float64)[:, :2]
+            coords.append(c)
+            ring_offsets.append(ring_offsets[-1] + len(c))
+        polygon_rings.append(len(ring_offsets) - 1)
+    coords = np.vstack(coords) if coords else np.zeros((0, 2))
+    return coords, np.array(ring_offsets, dtype=np.int64), np.array(polygon_rings, dtype=np.int64)
+
+def _unflatten_polygons(coords, ring_offsets, polygon_rings):
+    polygons = []
+    for p in range(len(polygon_rings) - 1):
+        rings = [coords[ring_offsets[r]:ring_offsets[r+1]] for r in range(polygon_rings[p], polygon_rings[p+1])]
+        polygons.append(Polygon(rings[0], rings[1:]))
+    return polygons
+
+def write_binary_environment(path, polygons, expanded, names, bounds, header=None, extra=None):
+    """Write polygons (and their expanded versions) in the compiled
+    format; bounds default to those of the polygons' vertices. extra maps
+    array prefixes to further polygon lists, or to (coords, ring_offsets,
+    polygon_rings) arrays already flattened. The file is written to a
+    temporary name and moved into place."""
+    arrays = {}
+    groups = [('', polygons), ('expanded_', expanded)] + list((extra or {}).items())
+    for prefix, group in groups:
+        flat = group if isinstance(group, tuple) else _flatten_polygons(group)
+        coords, ring_offsets, polygon_rings = flat
+        arrays[prefix + 'coords'] = coords
+        arrays[prefix + 'ring_offsets'] = ring_offsets
+        arrays[prefix + 'polygon_rings'] = polygon_rings
+    if bounds is None and len(arrays['coords']):
+        coords = arrays['coords']
+        bounds = tuple(coords.min(axis=0).tolist() + coords.max(axis=0).tolist())
+    header = dict(header or {})
+    header.update(format=BINARY_FORMAT, names=list(names), bounds=list(bounds) if bounds else None,
+                  arrays=[[k, a.dtype.str, list(a.shape)] for k, a in arrays.items()])
+    blob = json.dumps(header).encode('utf-8')
+    blob += b' ' * (-len(blob) % 8)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(np.array([len(blob)], dtype='<u8').tobytes())
+        f.write(blob)
+        for a in arrays.values():
+            f.write(np.ascontiguousarray(a).tobytes())
+    os.replace(tmp, path)
+
+def read_binary_environment(path):
+    """Return (header, arrays) of a compiled environment. The arrays are
+    read-only memory maps of the file, so processes loading the same file
+    share its pages."""
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise Exception("%s is not a compiled environment" % path)
+        n = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(n).decode('utf-8'))
+    offset = len(BINARY_MAGIC) + 8 + n
+    arrays = {}
+    for name, dtype, shape in header['arrays']:
+        count = int(np.prod(shape))
+        if count:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+        else:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        offset += count * np.dtype(dtype).itemsize
+    return header, arrays
+
+
+def _polygon_list(geometry):
+    """The polygons making up a Polygon or MultiPolygon."""
+    if geometry.is_empty:
+        return []
+    return list(geometry.geoms) if hasattr(geometry, 'geoms') else [geometry]
+
+
+def merge_polygons(polygons, tile=None):
+    """The union of polygons, cut into square tiles of side tile (default:
+    twice the median size of the polygons). Unioning alone tends to leave a
+    few huge polygons, which defeats the bounding-box filtering of an
+    ObstacleIndex; the tiles keep every piece about as small as the inputs
+    while dropping the overlaps between them."""
+    if not polygons:
+        return []
+    parts = _polygon_list(unary_union(polygons))
+    if tile is None:
+        b = np.array([p.bounds for p in polygons])
+        tile = 2 * float(np.median(np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1])))
+    if not tile > 0:
+        return parts
+    index = ObstacleIndex(parts)
+    b = np.array([p.bounds for p in parts])
+    minx, miny, maxx, maxy = b[:, 0].min(), b[:, 1].min(), b[:, 2].max(), b[:, 3].max()
+    pieces = []
+    for x in np.arange(minx, maxx, tile):
+        for y in np.arange(miny, maxy, tile):
+            cell = box(x, y, x + tile, y + tile)
+            for i in index.candidates(cell):
+                piece = parts[i].intersection(cell)
+                pieces.extend(g for g in _polygon_list(piece) if g.geom_type == 'Polygon')
+    return pieces
+
+
+def as_point(p):
+    """Accept a shapely Point or an (x, y) pair."""
+    return p if isinstance(p, Point) else Point(p[0], p[1])
+
+
+class ObstacleIndex:
+    """Bounding-box tree (STRtree) over a list of polygons, with a prepared
+    geometry per polygon. Queries only run exact predicates against the
+    polygons whose bounding boxes overlap the query geometry."""
+    def __init__(self, polygons):
+        self.polygons = list(polygons)
+        self.prepared = [prep(p) for p in self.polygons]
+        self.tree = STRtree(self.polygons)
+        self._edges = None
+        if hasattr(self.tree, 'query_items'):
+            # shapely 1.8: items default to the polygon indices
+            self._query, self._nearest = self.tree.query_items, self.tree.nearest_item
+        else:
+            self._query, self._nearest = self.tree.query, self.tree.nearest
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def candidates(self, geometry):
+        """Indices of polygons whose bounding box intersects geometry."""
+        if not self.polygons:
+            return []
+        return self._query(geometry)
+
+    def intersecting(self, geometry):
+        """Indices of polygons that intersect geometry."""
+        return [i for i in self.candidates(geometry) if self.prepared[i].intersects(geometry)]
+
+    def intersects(self, geometry):
+        for i in self.candidates(geometry):
+            if self.prepared[i].intersects(geometry):
+                return True
+        return False
+
+    def nearest(self, geometry):
+        """Return (index, distance) of the polygon closest to geometry, or
+        (None, inf) if the index is empty."""
+        if not self.polygons:
+            return None, math.inf
+        i = int(self._nearest(geometry))
+        return i, self.polygons[i].distance(geometry)
+
+    # Batched queries. These work on flat NumPy edge arrays rather than on
+    # shapely objects: queries are paired with polygons by bounding box, the
+    # pairs are expanded to (query, edge) pairs and every exact test is a
+    # single array expression. Queries are processed in chunks of
+    # batch_size to bound the size of the pair arrays.
+    batch_size = 2048
+
+    def _edge_arrays(self):
+        if self._edges is None:
+            segments, counts = [], []
+            for p in self.polygons:
+                n = 0
+                for ring in [p.exterior] + list(p.interiors):
+                    c = np.asarray(ring.coords, dtype=float)[:, :2]
+                    segments.append(np.hstack([c[:-1], c[1:]]))
+                    n += len(c) - 1
+                counts.append(n)
+            counts = np.array(counts, dtype=np.int64)
+            self._edges = np.vstack(segments) if segments else np.zeros((0, 4))
+            self._edge_counts = counts
+            self._edge_starts = np.cumsum(counts) - counts
+            self._bounds = np.array([p.bounds for p in self.polygons], dtype=float).reshape(-1, 4)
+        return self._edges
+
+    def _pairs(self, qmin, qmax):
+        """Expand queries with bounding boxes [qmin, qmax] into candidate
+        (query, polygon, edge) index arrays."""
+        b = self._bounds
+        overlap = ((qmin[:, None, 0] <= b[None, :, 2]) & (qmax[:, None, 0] >= b[None, :, 0]) &
+                   (qmin[:, None, 1] <= b[None, :, 3]) & (qmax[:, None, 1] >= b[None, :, 1]))
+        q, o = np.nonzero(overlap)
+        counts = self._edge_counts[o]
+        pair = np.repeat(np.arange(len(q)), counts)
+        offset = np.arange(len(pair)) - np.repeat(np.cumsum(counts) - counts, counts)
+        edge = np.repeat(self._edge_starts[o], counts) + offset
+        return q, pair, edge
+
+    def contains_points(self, points):
+        """Boolean mask of the (M, 2) array points that lie inside or on the
+        boundary of a polygon (even-odd rule, so holes are respected)."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        mask = np.zeros(len(points), dtype=bool)
+        if not self.polygons or not len(points):
+            return mask
+        edges = self._edge_arrays()
+        for lo in range(0, len(points), self.batch_size):
+            chunk = points[lo:lo+self.batch_size]
+            q, pair, edge = self._pairs(chunk, chunk)
+            px, py = chunk[q[pair], 0], chunk[q[pair], 1]
+            x0, y0, x1, y1 = edges[edge].T
+            straddles = (y0 > py) != (y1 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+            crossings = np.bincount(pair[straddles & (px < x_cross)], minlength=len(q))
+            # The crossing count is half-open; points on an edge are hits
+            # like they are for point_in_collision.
+            on_edge = (((x1 - x0) * (py - y0) == (y1 - y0) * (px - x0)) &
+                       (np.minimum(x0, x1) <= px) & (px <= np.maximum(x0, x1)) &
+                       (np.minimum(y0, y1) <= py) & (py <= np.maximum(y0, y1)))
+            mask[lo + q[crossings % 2 == 1]] = True
+            mask[lo + q[pair[on_edge]]] = True
+        return mask
+
+    def intersects_segments(self, starts, ends):
+        """Boolean mask of the segments starts[i]-ends[i] ((M, 2) arrays)
+        that intersect a polygon."""
+        starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        mask = self.contains_points(starts)
+        if not self.polygons or not len(starts):
+            return mask
+        edges = self._edge_arrays()
+        for lo in range(0, len(starts), self.batch_size):
+            a, b = starts[lo:lo+self.batch_size], ends[lo:lo+self.batch_size]
+            q, pair, edge = self._pairs(np.minimum(a, b), np.maximum(a, b))
+            ax, ay = a[q[pair], 0], a[q[pair], 1]
+            bx, by = b[q[pair], 0], b[q[pair], 1]
+            cx, cy, dx, dy = edges[edge].T
+            d1 = (dx - cx) * (ay - cy) - (dy - cy) * (ax - cx)
+            d2 = (dx - cx) * (by - cy) - (dy - cy) * (bx - cx)
+            d3 = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+            d4 = (bx - ax) * (dy - ay) - (by - ay) * (dx - ax)
+            hit = (d1 * d2 <= 0) & (d3 * d4 <= 0)
+            # Collinear segments only meet if their extents overlap.
+            collinear = (d1 == 0) & (d2 == 0)
+            overlap = ((np.maximum(ax, bx) >= np.minimum(cx, dx)) & (np.maximum(cx, dx) >= np.minimum(ax, bx)) &
+                       (np.maximum(ay, by) >= np.minimum(cy, dy)) & (np.maximum(cy, dy) >= np.minimum(ay, by)))
+            hit &= ~collinear | overlap
+            mask[lo + np.unique(q[pair[hit]])] = True
+        return mask
+
 
 class Environment:
-    def __init__(self, yaml_file=None, bounds=None):
+    # Robot footprint radius used to build expanded_obstacles.
+    robot_radius = 0.75/2
+
+    def __init__(self, yaml_file=None, bounds=None, use_cache=True):
         self.yaml_file = yaml_file
+        self.use_cache = use_cache
         self.environment_loaded = False
         self.obstacles = []
         self.obstacles_map = {}
+        # Obstacle name -> repairs repair_polygon made while loading it.
+        self.repairs = {}
+        self.expanded_obstacles = []
         self.bounds = bounds
+        # Bumped whenever the obstacles change (by build_index).
+        self.version = 0
+        # The version right after loading yaml_file, and the file's digest
+        # if use_cache computed it.
+        self._loaded_version = None
+        self._source_digest = None
+        self._data = self._data_file = None
+        self.build_index()
         if not yaml_file is None:
             if self.load_from_yaml_file(yaml_file):
-                if bounds is None:
+                if self.bounds is None:
                     self.calculate_scene_dimensions()
                 self.environment_loaded = True
 
@@ -64,22 +446,136 @@ class Environment:
 
     def add_obstacles(self, obstacles):
         self.obstacles = self.obstacles + obstacles
+        self.expanded_obstacles = self.expanded_obstacles + self.expand_obstacles(obstacles)
         self.calculate_scene_dimensions()
+        self.build_index()
+
+    def expand_obstacles(self, obstacles, radius=None):
+        """Buffer obstacles by radius, by default the robot radius
+        (configuration space)."""
+        radius = self.robot_radius if radius is None else radius
+        return [obs.buffer(radius, resolution=2) for obs in obstacles]
+
+    def build_index(self):
+        """(Re)build the spatial indices over obstacles and expanded_obstacles.
+        This counts as an obstacle change: version is bumped and the
+        configuration spaces cached by cspace() are dropped."""
+        self.obstacle_index = ObstacleIndex(self.obstacles)
+        self.collision_index = ObstacleIndex(self.expanded_obstacles)
+        self.version += 1
+        self.cspaces = {(self.robot_radius, False): (self.expanded_obstacles, self.collision_index)}
+        self._stored_cspaces = {}
+
+    def cspace(self, radius=None, merged=False):
+        """(polygons, ObstacleIndex) of the obstacles buffered by radius
+        (default robot_radius): the configuration space of a disc robot of
+        that radius. With merged, the polygons are unioned and retiled by
+        merge_polygons, which removes their overlaps.
+
+        Each one is computed on first use and kept in self.cspaces. An
+        environment loaded with use_cache also writes it to its compiled
+        copy, so later loads get it without buffering anything, unless the
+        obstacles were changed after loading."""
+        key = (self.robot_radius if radius is None else float(radius), bool(merged))
+        if key not in self.cspaces:
+            stored = self._stored_cspaces.pop(key, None)
+            if stored is not None:
+                polygons = _unflatten_polygons(*stored)
+            elif merged:
+                polygons = merge_polygons(self.cspace(key[0])[0])
+            else:
+                polygons = self.expand_obstacles(self.obstacles, key[0])
+            self.cspaces[key] = (polygons, ObstacleIndex(polygons))
+            if stored is None and self._source_digest is not None and self.unchanged_since_load():
+                try:
+                    self.save_to_binary(binary_cache_path(self.yaml_file), self._source_digest)
+                except OSError:
+                    pass
+        return self.cspaces[key]
+
+    def set_robot_radius(self, radius):
+        """Plan for a robot of another radius: expanded_obstacles and the
+        collision checks switch to its configuration space."""
+        self.expanded_obstacles, self.collision_index = self.cspace(radius)
+        self.robot_radius = float(radius)
+
+    def point_in_collision(self, point):
+        """True if point lies in (or on) an expanded obstacle."""
+        return self.collision_index.intersects(as_point(point))
+
+    def segment_in_collision(self, p1, p2):
+        """True if the straight segment p1-p2 touches an expanded obstacle."""
+        return self.collision_index.intersects(LineString([as_point(p1), as_point(p2)]))
+
+    def points_in_collision(self, points):
+        """Batched point_in_collision: boolean mask over an (M, 2) array."""
+        return self.collision_index.contains_points(points)
+
+    def segments_in_collision(self, starts, ends):
+        """Batched segment_in_collision: boolean mask over the segments
+        starts[i]-ends[i], given as (M, 2) arrays."""
+        return self.collision_index.intersects_segments(starts, ends)
+
+    def nearest_obstacle(self, point):
+        """Return (obstacle, distance) for the obstacle closest to point, or
+        (None, inf) if there are no obstacles."""
+        i, distance = self.obstacle_index.nearest(as_point(point))
+        if i is None:
+            return None, distance
+        return self.obstacles[i], distance
 
     def calculate_scene_dimensions(self):
         """Compute scene bounds from obstacles."""
-        points = []
-        for elem in self.obstacles:
-            points = points + list(elem.boundary.coords)
+        if not self.obstacles:
+            self.bounds = geom.MultiPoint([]).bounds
+            return
+        b = np.array([elem.bounds for elem in self.obstacles])
+        self.bounds = (b[:, 0].min(), b[:, 1].min(), b[:, 2].max(), b[:, 3].max())
 
-        mp = geom.MultiPoint(points)
-        self.bounds = mp.bounds
+    def unchanged_since_load(self):
+        """True while the obstacles are still the ones loaded from
+        yaml_file, so results derived from them may be cached by file."""
+        return self.yaml_file is not None and self._loaded_version == self.version
+
+    @property
+    def data(self):
+        """The whole YAML document obstacles were loaded from, or None.
+        Loading streams the obstacles instead of keeping the document, so
+        it is only parsed here, on first use."""
+        if self._data is None and self._data_file is not None:
+            with open(self._data_file) as f:
+                self._data = yaml.safe_load(f)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
 
     def load_from_yaml_file(self, yaml_file):
-        f = open(yaml_file)
-        self.data = yaml.safe_load(f)
-        f.close()
-        return self.parse_yaml_data(self.data)
+        """Load obstacles from yaml_file, streaming them through
+        ObstacleStream. With use_cache, a compiled copy is kept next to the
+        file (see binary_cache_path) and used instead of parsing whenever
+        the YAML is unchanged."""
+        self._data, self._data_file = None, yaml_file
+        if self.use_cache:
+            cache = binary_cache_path(yaml_file)
+            digest = file_digest(yaml_file)
+            if os.path.exists(cache) and self.load_from_binary(cache, digest):
+                self._source_digest, self._loaded_version = digest, self.version
+                return True
+        with open(yaml_file) as f:
+            stream = ObstacleStream(f)
+            self.parse_yaml_obstacles(stream)
+        loaded = stream.found
+        if loaded:
+            self._loaded_version = self.version
+        if loaded and self.use_cache:
+            self._source_digest = digest
+            try:
+                self.save_to_binary(cache, digest)
+            except OSError:
+                pass
+        return loaded
 
     def parse_yaml_data(self, data):
         if 'environment' in data:
@@ -91,9 +587,14 @@ class Environment:
             return False
 
     def parse_yaml_obstacles(self, obstacles):
+        """obstacles is the obstacles mapping of an environment, or any
+        iterable of (name, description) pairs such as an ObstacleStream."""
         self.obstacles = []
         self.obstacles_map = {}
-        for name, description in obstacles.items():
+        self.repairs = {}
+        if isinstance(obstacles, dict):
+            obstacles = obstacles.items()
+        for name, description in obstacles:
             # Double underscore not allowed in region names.
             if name.find("__") != -1:
                 raise Exception("Names cannot contain double underscores.")
@@ -107,7 +608,8 @@ class Environment:
                 raise Exception("%s is not valid!"%name)
             self.obstacles.append(parsed)
             self.obstacles_map[name] = parsed
-        self.expanded_obstacles = [obs.buffer(0.75/2, resolution=2) for obs in self.obstacles]
+        self.expanded_obstacles = self.expand_obstacles(self.obstacles)
+        self.build_index()
 
     
     def parse_rectangle(self, name, description):
@@ -132,12 +634,11 @@ class Environment:
         return out
 
     def parse_polygon(self, name, description):
-        _points = description['corners']
-        for points in itertools.permutations(_points):
-            polygon = geom.Polygon(points)
-            polygon.name = name
-            if polygon.is_valid:
-                return polygon
+        polygon, repairs = repair_polygon(description['corners'])
+        polygon.name = name
+        if repairs:
+            self.repairs[name] = repairs
+        return polygon
 
     def save_to_yaml(self, yaml_file):
         yaml_dict = {}
@@ -151,8 +652,59 @@ class Environment:
         yaml_dict['environment'] = {'obstacles' : obstacles}
         
         f = open(yaml_file, 'w')
-        f.write(yaml.dump(yaml_dict, default_flow_style=None))
+        f.write(yaml.dump(yaml_dict, default_flow_style=None, Dumper=YAML_DUMPER))
         f.close()
+
+    def save_to_binary(self, path, source_digest=None):
+        """Write obstacles, expanded obstacles, names, obstacle bounds and the other
+        configuration spaces computed so far in the compiled format.
+        source_digest records the YAML file it came from."""
+        names = [getattr(ob, 'name', None) or "obstacle%.4d"%i for i, ob in enumerate(self.obstacles)]
+        rectangles = {}
+        for name, ob in zip(names, self.obstacles):
+            if hasattr(ob, 'cc_length'):
+                rectangles[name] = [ob.cc_length, ob.cc_width, ob.cc_rotation]
+        cspaces = [(key, polygons) for key, (polygons, _) in self.cspaces.items()
+                   if key != (self.robot_radius, False)] + list(self._stored_cspaces.items())
+        extra = dict(('cspace%d_' % i, polygons) for i, (_, polygons) in enumerate(cspaces))
+        listed = [[radius, merged, 'cspace%d_' % i] for i, ((radius, merged), _) in enumerate(cspaces)]
+        # The bounds written are those of the obstacles, never a caller's bounds=.
+        write_binary_environment(path, self.obstacles, self.expanded_obstacles, names, None,
+                                 {'source_sha1': source_digest, 'robot_radius': self.robot_radius,
+                                  'rectangles': rectangles, 'repairs': self.repairs, 'cspaces': listed},
+                                 extra)
+
+    def load_from_binary(self, path, source_digest=None):
+        """Load a file written by save_to_binary. Returns False without
+        loading anything if it was written in another BINARY_FORMAT, or if
+        source_digest is given and does not match."""
+        header, arrays = read_binary_environment(path)
+        if header.get('format') != BINARY_FORMAT:
+            return False
+        if source_digest is not None and header.get('source_sha1') != source_digest:
+            return False
+        self.obstacles = _unflatten_polygons(arrays['coords'], arrays['ring_offsets'], arrays['polygon_rings'])
+        self.obstacles_map = {}
+        for name, ob in zip(header['names'], self.obstacles):
+            ob.name = name
+            if name in header['rectangles']:
+                ob.cc_length, ob.cc_width, ob.cc_rotation = header['rectangles'][name]
+            self.obstacles_map[name] = ob
+        self.repairs = header.get('repairs', {})
+        if self.bounds is None and header['bounds']:
+            self.bounds = tuple(header['bounds'])
+        stored = {}
+        for radius, merged, prefix in [[header['robot_radius'], False, 'expanded_']] + header.get('cspaces', []):
+            stored[(radius, merged)] = (arrays[prefix + 'coords'], arrays[prefix + 'ring_offsets'],
+                                        arrays[prefix + 'polygon_rings'])
+        own = stored.pop((self.robot_radius, False), None)
+        if own is not None:
+            self.expanded_obstacles = _unflatten_polygons(*own)
+        else:
+            self.expanded_obstacles = self.expand_obstacles(self.obstacles)
+        self.build_index()
+        self._stored_cspaces = stored
+        return True
     
 def random_environment(bounds, start, radius, goals, n, size_limits=(0.5, 1.5)):
     minx, miny, maxx, maxy = bounds
@@ -192,4 +744,56 @@ def random_environment(bounds, start, radius, goals, n, size_limits=(0.5, 1.5)):
             obs.append(p)
 #         coords = xy + [l*np.cos(a),l*np.sin(a) for a,l in zip(angles,lengths)]
     env.add_obstacles(obs)
-    return env
\ No newline at end of file
+    return env
+
+def generate_random_environment(bounds, start, radius, goals, n, size_limits=(0.5, 1.5), seed=None,
+                                batch_size=None):
+    """Vectorised, seedable counterpart of random_environment.
+
+    Draws the same kind of random star-shaped quadrilaterals, but a batch of
+    candidates at a time with NumPy from np.random.default_rng(seed) (seed
+    may also be a Generator). Candidates are rejected against the start disc
+    and the goal regions first by bounding box and then, for the few that
+    overlap one, with an ObstacleIndex over those regions. Use
+    save_to_yaml or save_to_binary on the result to write it out."""
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    # allow obstacles to span the border
+    minx = minx - size_limits[0]/2
+    maxx = maxx + size_limits[0]/2
+    miny = miny - size_limits[0]/2
+    maxy = maxy + size_limits[0]/2
+    edges = 4
+    minl, maxl = size_limits
+    keep_out = [Point(start).buffer(radius, resolution=3)] + list(goals)
+    keep_out_index = ObstacleIndex(keep_out)
+    kb = np.array([g.bounds for g in keep_out])
+
+    accepted, have = [np.zeros((0, edges, 2))], 0
+    while have < n:
+        m = batch_size or max(64, int(1.2 * (n - have)))
+        centers = rng.uniform((minx, miny), (maxx, maxy), size=(m, 2))
+        angles = np.cumsum(rng.random((m, edges)), axis=1)
+        angles = 2*np.pi * angles / angles[:, -1:] + 2*np.pi * rng.random((m, 1))
+        lengths = 0.5*minl + (maxl-minl) * 0.5 * rng.random((m, edges))
+        corners = centers[:, None, :] + lengths[:, :, None] * np.stack([np.cos(angles), np.sin(angles)], axis=2)
+
+        cmin, cmax = corners.min(axis=1), corners.max(axis=1)
+        near = ((cmin[:, None, 0] <= kb[None, :, 2]) & (cmax[:, None, 0] >= kb[None, :, 0]) &
+                (cmin[:, None, 1] <= kb[None, :, 3]) & (cmax[:, None, 1] >= kb[None, :, 1])).any(axis=1)
+        ok = ~near
+        for i in np.nonzero(near)[0]:
+            ok[i] = not keep_out_index.intersects(Polygon(corners[i]))
+        accepted.append(corners[ok])
+        have += int(ok.sum())
+
+    corners = np.concatenate(accepted)[:n]
+    env = Environment(None)
+    env.obstacles = [Polygon(c) for c in corners]
+    env.expanded_obstacles = env.expand_obstacles(env.obstacles)
+    if n:
+        env.bounds = tuple(corners.min(axis=(0, 1)).tolist() + corners.max(axis=(0, 1)).tolist())
+    else:
+        env.calculate_scene_dimensions()
+    env.build_index()
+    return env
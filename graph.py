@@ -1,6 +1,10 @@
-import pydot_ng as pydot
-import networkx as nx
-import matplotlib.pyplot as plt
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
 
 class NodeNotInGraph(Exception):
     def __init__(self, node):
@@ -17,7 +21,7 @@ class Edge(object):
         self.weight = weight
 
     def __hash__(self):
-        return hash("%s_%s_%f" % (self.source, self.target, self.weight))
+        return hash((self.source, self.target, self.weight))
 
     def __eq__(self, other):
         return self.source == other.source and self.target == other.target \
@@ -26,25 +30,54 @@ class Edge(object):
         return "Edge(%r,%r,%r)" % (self.source, self.target, self.weight)
 
 
+def floyd_warshall(weights):
+    """All-pairs shortest path lengths for a dense (n, n) weight matrix with
+    inf for missing edges; one vectorised relaxation per intermediate node."""
+    dist = np.array(weights, dtype=np.float64)
+    np.fill_diagonal(dist, np.minimum(dist.diagonal(), 0.0))
+    for k in range(len(dist)):
+        np.minimum(dist, dist[:, k, None] + dist[None, k, :], out=dist)
+    return dist
+
+
+_worker_graph = None
+
+def _init_distance_worker(path):
+    global _worker_graph
+    _worker_graph = FrozenGraph.load(path).csgraph()
+
+def _dijkstra_rows(sources):
+    from scipy.sparse.csgraph import dijkstra
+    return dijkstra(_worker_graph, indices=sources)
+
+
 class Graph(object):
     def __init__(self, node_label_fn=None):
         self._nodes = set()
         self._edges = dict()
         self.node_label_fn = node_label_fn if node_label_fn else lambda x: x
         self.node_positions = dict()
+        # Bumped by every change to the nodes or edges; keys the
+        # distance_matrix caches.
+        self.version = 0
+        self._frozen = None
+        self._distances = {}
 
     def __contains__(self, node):
         return node in self._nodes
 
     def add_node(self, node):
         """Adds a node to the graph."""
-        self._nodes.add(node)
+        if node not in self._nodes:
+            self._nodes.add(node)
+            self.version += 1
     
     def add_edge(self, node1, node2, weight=1.0, bidirectional=True):
         """Adds an edge between node1 and node2. Adds the nodes to the graph first
         if they don't exist."""
         self.add_node(node1)
         self.add_node(node2)
+        self.version += 1
         node1_edges = self._edges.get(node1, set())
         node1_edges.add(Edge(node1, node2, weight))
         self._edges[node1] = node1_edges
@@ -59,6 +92,7 @@ class Graph(object):
             node_edges = self._edges[node]
             if node == child:
                 self._edges.pop(node)
+                self.version += 1
                 flag = 1
                 break
             if flag == 1:
@@ -68,6 +102,30 @@ class Graph(object):
             #        node_edges.remove(edge)
             #        break
 
+    def remove_edge(self, node1, node2, bidirectional=True):
+        """Removes every edge from node1 to node2 (and back, if bidirectional)."""
+        pairs = [(node1, node2), (node2, node1)] if bidirectional else [(node1, node2)]
+        for source, target in pairs:
+            edges = self._edges.get(source)
+            if edges:
+                kept = set(e for e in edges if e.target != target)
+                if len(kept) != len(edges):
+                    self._edges[source] = kept
+                    self.version += 1
+
+    def remove_node(self, node):
+        """Removes a node together with every edge from or to it, including
+        one-way edges that point at it."""
+        if not node in self:
+            raise NodeNotInGraph(node)
+        self._edges.pop(node, None)
+        for source, edges in self._edges.items():
+            if any(e.target == node for e in edges):
+                self._edges[source] = set(e for e in edges if e.target != node)
+        self._nodes.discard(node)
+        self.node_positions.pop(node, None)
+        self.version += 1
+
     def set_node_positions(self, positions):
         self.node_positions = positions
 
@@ -87,70 +145,190 @@ class Graph(object):
             raise NodeNotInGraph(node)
         return self._edges.get(node, set())
 
-    def draw(self, highlight_edges=None):
-        nxg = nx.DiGraph()
-        edges = [(e.source, e.target, {'weight':e.weight, 'inv_weight':1.0/e.weight}) for node_set in self._edges.values() for e in node_set]
-        nxg.add_edges_from(edges)
-        if len(self.node_positions) < len(self._nodes):
-            # Calculate positions for nodes whose pos is not specified.
-            pos = nx.spring_layout(nxg, weight='inv_weight', pos=self.node_positions, fixed=self.node_positions.keys() if self.node_positions else None)
+    def neighbors(self, node):
+        """Yields (target, weight) for each edge leaving node."""
+        for e in self.node_edges(node):
+            yield e.target, e.weight
+
+    def freeze(self):
+        """Returns a read-only compressed-sparse-row copy of the graph."""
+        labels = list(self._nodes)
+        ids = {n: i for i, n in enumerate(labels)}
+        indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+        indices, weights = [], []
+        for i, n in enumerate(labels):
+            edges = self._edges.get(n, ())
+            indptr[i+1] = indptr[i] + len(edges)
+            for e in edges:
+                indices.append(ids[e.target])
+                weights.append(e.weight)
+        return FrozenGraph(labels, indptr, np.array(indices, dtype=np.int32),
+                           np.array(weights, dtype=np.float64),
+                           {n: p for n, p in self.node_positions.items()})
+
+    def distance_matrix(self, sources, targets=None, processes=1, method='auto', dense_limit=500):
+        """Shortest path lengths from each node of sources to each node of
+        targets (default: sources) as a read-only (len(sources),
+        len(targets)) array, inf where a target is unreachable.
+
+        method 'dijkstra' runs one Dijkstra per source over the frozen
+        adjacency; with processes > 1 the sources are split over a process
+        pool whose workers memory-map one copy of it. 'floyd_warshall'
+        solves all pairs at once on a dense matrix, which pays off for small
+        dense graphs; 'auto' picks it when the graph has at most dense_limit
+        nodes and a quarter of all possible edges. Results are cached until
+        the graph changes."""
+        from scipy.sparse.csgraph import dijkstra
+        sources = list(sources)
+        targets = sources if targets is None else list(targets)
+        if self._frozen is None or self._frozen[0] != self.version:
+            self._frozen = (self.version, self.freeze())
+        frozen = self._frozen[1]
+        n = len(frozen)
+        if method == 'auto':
+            dense = n <= dense_limit and frozen.num_edges >= n * n / 4
+            method = 'floyd_warshall' if dense else 'dijkstra'
+        if method not in ('dijkstra', 'floyd_warshall'):
+            raise Exception("Unknown distance matrix method %r" % method)
+        key = (tuple(sources), tuple(targets), method)
+        cached = self._distances.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        src = np.array([frozen._id(s) for s in sources], dtype=np.int64)
+        dst = np.array([frozen._id(t) for t in targets], dtype=np.int64)
+        if method == 'floyd_warshall':
+            matrix = floyd_warshall(frozen.dense_weights())[np.ix_(src, dst)]
         else:
-            pos = self.node_positions
-
-        f = plt.figure(figsize=(12,12))
-        plt.gca().set_aspect('equal', adjustable='box')
-        nx.draw_networkx_nodes(nxg, pos, node_color='w')
-        nx.draw_networkx_edges(nxg, pos, edges)
-        nx.draw_networkx_labels(nxg, pos)
-        edge_labels=dict([((u,v,),"%s" % d['weight'])
-                 for u,v,d in nxg.edges(data=True)])
-        nx.draw_networkx_edge_labels(nxg, pos, edge_labels=edge_labels)
-
-
-        if highlight_edges:
-            nx.draw_networkx_edges(nxg, pos, highlight_edges, edge_color='r')
-        
-        plt.axis('off')
-        plt.show()
-
-    def draw_edges(self, edges):
-        # print edges
-        nx.draw_networkx_edges(nxg, pos, edges, edge_color='r')
-        reduced_labels = {(u,v): edge_labels[(u,v)] for u,v,_ in edges}
-        nx.draw_networkx_edge_labels(nxg, pos, edge_labels=reduced_labels, font_color='r')
-        
-        reduced_nodes = set([u for u,_,_ in edges])
-        reduced_nodes.update([v for _,v,_ in edges])
-        # nx.draw_networkx_nodes(nxg, pos, nodelist=reduced_nodes,  node_color='r')
-        red_labels = {n:n for n in reduced_nodes}
-        print(red_labels)
-        nx.draw_networkx_labels(nxg, pos, labels=red_labels, font_color='r')
-
-    def highlight_edges(self, edges):
-        nx.draw_networkx_edges(nxg, pos, edges, edge_color='r')
-        reduced_labels = {(u,v): edge_labels[(u,v)] for u,v,_ in edges}
-        nx.draw_networkx_edge_labels(nxg, pos, edge_labels=reduced_labels, font_color='r')
-        
-        reduced_nodes = set([u for u,_,_ in edges])
-        reduced_nodes.update([v for _,v,_ in edges])
-        # nx.draw_networkx_nodes(nxg, pos, nodelist=reduced_nodes,  node_color='r')
-        red_labels = {n:n for n in reduced_nodes}
-        print(red_labels)
-        nx.draw_networkx_labels(nxg, pos, labels=red_labels, font_color='r')
+            rows, order = np.unique(src, return_inverse=True)
+            if processes > 1 and len(rows) > processes:
+                path = tempfile.mkdtemp()
+                try:
+                    frozen.save(path)
+                    chunks = np.array_split(rows, processes * 4)
+                    with multiprocessing.Pool(processes, _init_distance_worker, (path,)) as pool:
+                        dist = np.vstack(pool.map(_dijkstra_rows, chunks))
+                finally:
+                    shutil.rmtree(path, ignore_errors=True)
+            else:
+                dist = np.atleast_2d(dijkstra(frozen.csgraph(), indices=rows))
+            matrix = dist[order][:, dst]
+        matrix.flags.writeable = False
+        if self._distances and next(iter(self._distances.values()))[0] != self.version:
+            self._distances.clear()
+        self._distances[key] = (self.version, matrix)
+        return matrix
+
+    def draw(self, highlight_edges=None):
+        from visualization import draw_graph
+        draw_graph(self, highlight_edges)
 
     def _create_dot_graph(self):
-        dot_graph = pydot.Dot(graph_type='digraph', concentrate=True, rankdir="LR")
-        dot_graph.set_node_defaults(shape='rect', fontsize=12)
-        for n in self._nodes:
-            node_name = self.node_label_fn(n)
-            node = pydot.Node(shape="ellipse", name=node_name)
-            if n in self.node_positions:
-                node.set_pos("%d,%d!" % (self.node_positions[n][0], self.node_positions[n][1]))
-            dot_graph.add_node(node)
-        for src_node, edges in self._edges.items():
-            for e in edges:
-                dot_graph.add_edge(pydot.Edge(self.node_label_fn(src_node), self.node_label_fn(e.target), label=e.weight if e.weight!=1.0 else ""))
-        return dot_graph
+        from visualization import dot_graph
+        return dot_graph(self)
 
     def _repr_svg_(self):
         return self._create_dot_graph().create_svg()
+
+
+class FrozenGraph(object):
+    """Immutable graph in compressed-sparse-row form, made by Graph.freeze().
+
+    Node i (label labels[i]) has edges to indices[indptr[i]:indptr[i+1]]
+    with the matching weights. It supports the read side of the Graph API
+    (in, node_edges, neighbors, get_node_pos) so the search routines accept
+    either. save() writes the arrays as .npy files that load() can
+    memory-map, so a large roadmap can be shared without rebuilding it."""
+    def __init__(self, labels, indptr, indices, weights, node_positions=None):
+        self.labels = labels
+        self.ids = {n: i for i, n in enumerate(labels)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.node_positions = node_positions or {}
+
+    def __contains__(self, node):
+        return node in self.ids
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def _id(self, node):
+        try:
+            return self.ids[node]
+        except KeyError:
+            raise NodeNotInGraph(node)
+
+    def neighbor_ids(self, i):
+        """(indices, weights) arrays of the edges leaving node id i."""
+        lo, hi = self.indptr[i], self.indptr[i+1]
+        return self.indices[lo:hi], self.weights[lo:hi]
+
+    def neighbors(self, node):
+        """Yields (target, weight) for each edge leaving node."""
+        targets, weights = self.neighbor_ids(self._id(node))
+        labels = self.labels
+        for j, w in zip(targets.tolist(), weights.tolist()):
+            yield labels[j], w
+
+    def node_edges(self, node):
+        return set(Edge(node, target, w) for target, w in self.neighbors(node))
+
+    def get_node_pos(self, node):
+        self._id(node)
+        return self.node_positions[node]
+
+    def csgraph(self):
+        """The adjacency as an (n, n) scipy.sparse CSR matrix for
+        scipy.sparse.csgraph, keeping the cheapest of parallel edges."""
+        from scipy.sparse import csr_matrix
+        n = len(self.labels)
+        rows = np.repeat(np.arange(n), np.diff(self.indptr))
+        cols = np.asarray(self.indices, dtype=np.int64)
+        weights = np.asarray(self.weights)
+        order = np.lexsort((weights, cols, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        return csr_matrix((weights[first], (rows[first], cols[first])), shape=(n, n))
+
+    def dense_weights(self):
+        """The adjacency as an (n, n) array of edge weights, inf where there
+        is no edge, keeping the cheapest of parallel edges."""
+        n = len(self.labels)
+        dense = np.full((n, n), np.inf)
+        np.minimum.at(dense, (np.repeat(np.arange(n), np.diff(self.indptr)), self.indices), self.weights)
+        return dense
+
+    def thaw(self):
+        """Returns a mutable Graph with the same nodes and edges."""
+        g = Graph()
+        for n in self.labels:
+            g.add_node(n)
+        for n in self.labels:
+            for target, w in self.neighbors(n):
+                g.add_edge(n, target, w, bidirectional=False)
+        g.set_node_positions(dict(self.node_positions))
+        return g
+
+    def save(self, path):
+        """Writes the graph to directory path."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'indices.npy'), self.indices)
+        np.save(os.path.join(path, 'weights.npy'), self.weights)
+        with open(os.path.join(path, 'nodes.pkl'), 'wb') as f:
+            pickle.dump((self.labels, self.node_positions), f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Loads a graph written by save(). With the default mmap_mode the
+        arrays are memory-mapped read-only rather than read into memory."""
+        arrays = [np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+                  for name in ('indptr.npy', 'indices.npy', 'weights.npy')]
+        with open(os.path.join(path, 'nodes.pkl'), 'rb') as f:
+            labels, node_positions = pickle.load(f)
+        return cls(labels, *arrays, node_positions=node_positions)
@@ -0,0 +1,245 @@
+import math
+
+import numpy as np
+
+from environment import ObstacleIndex
+from search_classes import SearchNode, Path
+from utils import PriorityQueue
+
+
+class DStarLite:
+    """Incremental shortest paths on a graph.Graph (D* Lite).
+
+    The search runs backwards from goal, keeping g (cost-to-goal estimates)
+    and rhs (one-step lookahead) values between queries. After an edge or
+    obstacle change only the nodes whose cost-to-goal actually changed are
+    re-expanded, and move_to() lets the start follow the robot without
+    discarding that work; with a fixed start this is LPA*.
+
+    Changes must go through the planner (add_edge, remove_edge,
+    delete_edge, add_obstacle, ...), which applies them to the graph as well
+    and keeps its own successor/predecessor costs in sync. heuristic(state,
+    other) must be consistent; without one every key is the plain g value.
+    expanded counts the nodes popped by plan() calls so far."""
+    def __init__(self, graph, start, goal, heuristic=None):
+        self.graph = graph
+        self.start = start
+        self.goal = goal
+        self.heuristic = heuristic
+        self.succ = {}
+        self.pred = {}
+        for node in graph._nodes:
+            self.succ.setdefault(node, {})
+            self.pred.setdefault(node, {})
+        for node, edges in graph._edges.items():
+            for e in edges:
+                self._set_cost(node, e.target, e.weight)
+        self.g = {}
+        self.rhs = {goal: 0.0}
+        self.km = 0.0
+        self.last = start
+        self.expanded = 0
+        self.obstacles = {}
+        self.blocked_by = {}
+        self._next_oid = 0
+        self._table = None
+        self.open = PriorityQueue(min, self._key)
+        self.open.append(goal)
+
+    def _set_cost(self, u, v, weight):
+        # Parallel edges collapse to the cheapest one.
+        out = self.succ.setdefault(u, {})
+        if weight < out.get(v, math.inf):
+            out[v] = weight
+            self.pred.setdefault(v, {})[u] = weight
+        self.succ.setdefault(v, {})
+        self.pred.setdefault(u, {})
+
+    def _h(self, s):
+        return self.heuristic(s, self.start) if self.heuristic else 0.0
+
+    def _key(self, s):
+        m = min(self.g.get(s, math.inf), self.rhs.get(s, math.inf))
+        return (m + self._h(s) + self.km, m)
+
+    def _update_vertex(self, u):
+        if self.g.get(u, math.inf) != self.rhs.get(u, math.inf):
+            self.open.append(u)
+        else:
+            del self.open[u]
+
+    def _recompute_rhs(self, u):
+        if u != self.goal:
+            g = self.g
+            self.rhs[u] = min([w + g.get(v, math.inf) for v, w in self.succ[u].items()], default=math.inf)
+
+    def _cost_changed(self, u, v, old, new):
+        """Repair rhs(u) after the cost of edge u->v went from old to new."""
+        if u == self.goal:
+            return
+        g_v = self.g.get(v, math.inf)
+        rhs_u = self.rhs.get(u, math.inf)
+        if new < old:
+            if new + g_v < rhs_u:
+                self.rhs[u] = new + g_v
+        elif rhs_u == old + g_v:
+            self._recompute_rhs(u)
+        self._update_vertex(u)
+
+    def plan(self):
+        """Repair the search after the changes made since the last call and
+        return the current shortest Path from start to goal, or None."""
+        open, g, rhs, pred = self.open, self.g, self.rhs, self.pred
+        goal, start, inf = self.goal, self.start, math.inf
+        while len(open) and (open.A[0][0] < self._key(start) or
+                             rhs.get(start, inf) != g.get(start, inf)):
+            k_old = open.A[0][0]
+            u = open.peek()
+            self.expanded += 1
+            k_new = self._key(u)
+            g_u, rhs_u = g.get(u, inf), rhs.get(u, inf)
+            if k_old < k_new:
+                open.append(u)
+            elif g_u > rhs_u:
+                # Overconsistent: settle u and offer it to its predecessors.
+                g[u] = rhs_u
+                del open[u]
+                for s, w in pred[u].items():
+                    if s != goal and w + rhs_u < rhs.get(s, inf):
+                        rhs[s] = w + rhs_u
+                    self._update_vertex(s)
+            else:
+                # Underconsistent: u got more expensive; predecessors that
+                # relied on it look for another successor.
+                g[u] = inf
+                for s, w in pred[u].items():
+                    if rhs.get(s, inf) == w + g_u:
+                        self._recompute_rhs(s)
+                    self._update_vertex(s)
+                self._recompute_rhs(u)
+                self._update_vertex(u)
+        return self.path()
+
+    def path(self):
+        """Follow the cheapest successors from start to goal."""
+        g = self.g
+        if g.get(self.start, math.inf) == math.inf:
+            return None
+        node = SearchNode(self.start)
+        state, cost, visited = self.start, 0.0, set([self.start])
+        while state != self.goal:
+            best, best_w = None, math.inf
+            for v, w in self.succ[state].items():
+                if w + g.get(v, math.inf) < best_w + g.get(best, math.inf):
+                    best, best_w = v, w
+            if best is None or best in visited:
+                return None
+            cost += best_w
+            node = SearchNode(best, node, cost)
+            visited.add(best)
+            state = best
+        return Path(node)
+
+    def move_to(self, start):
+        """Move the start (the robot) to another node of the graph. Keys
+        already queued stay valid lower bounds because km grows by the
+        heuristic distance moved."""
+        if self.heuristic:
+            self.km += self.heuristic(self.last, start)
+        self.last = self.start = start
+
+    def add_edge(self, node1, node2, weight=1.0, bidirectional=True):
+        """Add an edge (or a cheaper parallel one) to the graph."""
+        self.graph.add_edge(node1, node2, weight, bidirectional)
+        pairs = [(node1, node2), (node2, node1)] if bidirectional else [(node1, node2)]
+        for u, v in pairs:
+            old = self.succ.get(u, {}).get(v, math.inf)
+            self._set_cost(u, v, weight)
+            self._cost_changed(u, v, old, self.succ[u][v])
+        self._table = None
+
+    def remove_edge(self, node1, node2, bidirectional=True):
+        """Remove every edge from node1 to node2 (and back, if bidirectional)."""
+        self.graph.remove_edge(node1, node2, bidirectional)
+        pairs = [(node1, node2), (node2, node1)] if bidirectional else [(node1, node2)]
+        for u, v in pairs:
+            old = self.succ.get(u, {}).pop(v, None)
+            if old is not None:
+                del self.pred[v][u]
+                self._cost_changed(u, v, old, math.inf)
+
+    def set_edge_weight(self, node1, node2, weight, bidirectional=True):
+        """Replace the edges between node1 and node2 by one of the given weight."""
+        self.remove_edge(node1, node2, bidirectional)
+        self.add_edge(node1, node2, weight, bidirectional)
+
+    def delete_edge(self, node):
+        """Graph.delete_edge counterpart: drop every edge leaving node."""
+        for v in list(self.succ.get(node, ())):
+            self.remove_edge(node, v, bidirectional=False)
+
+    def _position(self, node):
+        return self.graph.node_positions.get(node, node)
+
+    def _edge_table(self):
+        """(edges, segments) for every edge: (u, v) pairs and an (E, 4)
+        array of their end positions. Built on demand and kept across
+        removals, which are filtered out by the caller; new edges rebuild it."""
+        if self._table is None:
+            edges = [(u, v) for u, out in self.succ.items() for v in out]
+            position = self._position
+            segments = np.array([tuple(position(u)[:2]) + tuple(position(v)[:2]) for u, v in edges],
+                                dtype=float).reshape(-1, 4)
+            self._table = edges, segments
+        return self._table
+
+    def _crossing(self, polygon, edges, segments):
+        """The indices of the segments that intersect polygon."""
+        minx, miny, maxx, maxy = polygon.bounds
+        x0, y0, x1, y1 = segments.T
+        near = np.nonzero((np.maximum(x0, x1) >= minx) & (np.minimum(x0, x1) <= maxx) &
+                          (np.maximum(y0, y1) >= miny) & (np.minimum(y0, y1) <= maxy))[0]
+        if not len(near):
+            return near
+        return near[ObstacleIndex([polygon]).intersects_segments(segments[near, :2], segments[near, 2:])]
+
+    def add_obstacle(self, polygon):
+        """Remove the edges whose segments (between node positions) intersect
+        polygon, which should already be in configuration space (e.g. from
+        Environment.expand_obstacles). Returns an id for remove_obstacle."""
+        oid = self._next_oid
+        self._next_oid += 1
+        edges, segments = self._edge_table()
+        blocked = set()
+        for i in self._crossing(polygon, edges, segments):
+            u, v = edges[i]
+            w = self.succ[u].get(v)
+            if w is not None:
+                blocked.add((u, v, w))
+                self.remove_edge(u, v, bidirectional=False)
+        self.obstacles[oid] = polygon
+        self.blocked_by[oid] = blocked
+        return oid
+
+    def remove_obstacle(self, oid):
+        """Restore the edges blocked by obstacle oid, except those another
+        obstacle still crosses (they are handed over to it)."""
+        del self.obstacles[oid]
+        edges = list(self.blocked_by.pop(oid))
+        position = self._position
+        for other, polygon in self.obstacles.items():
+            if not edges:
+                break
+            segments = np.array([tuple(position(u)[:2]) + tuple(position(v)[:2]) for u, v, _ in edges],
+                                dtype=float)
+            hit = set(self._crossing(polygon, edges, segments).tolist())
+            self.blocked_by[other].update(edges[i] for i in hit)
+            edges = [e for i, e in enumerate(edges) if i not in hit]
+        for u, v, w in edges:
+            self.add_edge(u, v, w, bidirectional=False)
+
+    def add_environment_obstacles(self, env, obstacles):
+        """Add obstacles to env and block the edges their expanded shapes cross.
+        Returns the obstacle ids."""
+        env.add_obstacles(obstacles)
+        return [self.add_obstacle(p) for p in env.expanded_obstacles[-len(obstacles):]] if obstacles else []
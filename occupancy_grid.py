@@ -0,0 +1,207 @@
+import hashlib
+import math
+import os
+
+import numpy as np
+from scipy import ndimage
+
+from environment import file_digest
+from search_classes import SearchNode, Path
+from utils import PriorityQueue
+
+
+def default_cache_dir(yaml_file):
+    return os.path.join(os.path.dirname(os.path.abspath(yaml_file)), '.planner_cache')
+
+
+class OccupancyGrid:
+    """Raster of an Environment's expanded obstacles.
+
+    Cell (row, col) covers [x0 + col*res, x0 + (col+1)*res) x
+    [y0 + row*res, y0 + (row+1)*res) and is occupied if its center lies in an
+    expanded obstacle, so the resolution should be well below the robot
+    radius. sdf holds the signed distance (world units) from each cell to
+    the obstacle boundary: positive in free space, negative inside."""
+    def __init__(self, occupancy, sdf, origin, resolution):
+        self.occupancy = occupancy
+        self.sdf = sdf
+        self.origin = tuple(origin)
+        self.resolution = resolution
+
+    def __repr__(self):
+        return "<OccupancyGrid %dx%d, resolution: %s, origin: %s>" % (self.shape[0], self.shape[1],
+                                                                     self.resolution, self.origin)
+
+    @property
+    def shape(self):
+        return self.occupancy.shape
+
+    @property
+    def bounds(self):
+        rows, cols = self.shape
+        x0, y0 = self.origin
+        return (x0, y0, x0 + cols*self.resolution, y0 + rows*self.resolution)
+
+    @classmethod
+    def from_environment(cls, env, resolution, bounds=None, cache_dir=None):
+        """Rasterize env.expanded_obstacles over bounds (default env.bounds).
+        If env was loaded from a YAML file the grid is cached on disk, keyed
+        by the file's hash, the resolution, the bounds and the robot radius;
+        once the obstacles have been changed in memory it is not cached."""
+        bounds = tuple(bounds if bounds is not None else env.bounds)
+        path = None
+        if env.unchanged_since_load():
+            key = "%s_%r_%r_%r" % (file_digest(env.yaml_file), resolution, bounds, env.robot_radius)
+            cache_dir = cache_dir or default_cache_dir(env.yaml_file)
+            path = os.path.join(cache_dir, "grid_%s.npz" % hashlib.sha1(key.encode()).hexdigest())
+            if os.path.exists(path):
+                return cls.load(path)
+        grid = cls.rasterize(env, resolution, bounds)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            grid.save(path)
+        return grid
+
+    @classmethod
+    def rasterize(cls, env, resolution, bounds):
+        minx, miny, maxx, maxy = bounds
+        cols = max(1, int(math.ceil((maxx - minx) / resolution)))
+        rows = max(1, int(math.ceil((maxy - miny) / resolution)))
+        xs = minx + (np.arange(cols) + 0.5) * resolution
+        ys = miny + (np.arange(rows) + 0.5) * resolution
+        cx, cy = np.meshgrid(xs, ys)
+        centers = np.column_stack([cx.ravel(), cy.ravel()])
+        occupancy = env.points_in_collision(centers).reshape(rows, cols)
+        return cls(occupancy, signed_distance_field(occupancy, resolution), (minx, miny), resolution)
+
+    def save(self, path):
+        np.savez_compressed(path, occupancy=self.occupancy, sdf=self.sdf,
+                            origin=np.array(self.origin), resolution=np.array(self.resolution))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['occupancy'], data['sdf'], data['origin'], float(data['resolution']))
+
+    def world_to_cell(self, point):
+        """(row, col) of the cell containing point; works on (M, 2) arrays too."""
+        p = np.asarray(point, dtype=float)
+        col = np.floor((p[..., 0] - self.origin[0]) / self.resolution).astype(int)
+        row = np.floor((p[..., 1] - self.origin[1]) / self.resolution).astype(int)
+        return row, col
+
+    def cell_to_world(self, cell):
+        """Center of cell (row, col)."""
+        row, col = cell
+        return (self.origin[0] + (col + 0.5) * self.resolution,
+                self.origin[1] + (row + 0.5) * self.resolution)
+
+    def in_bounds(self, row, col):
+        rows, cols = self.shape
+        return (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+
+    def in_collision(self, point):
+        """Occupancy lookup for a point or an (M, 2) array of points. Points
+        outside the grid count as in collision."""
+        row, col = self.world_to_cell(point)
+        inside = self.in_bounds(row, col)
+        rows, cols = self.shape
+        hit = self.occupancy[np.clip(row, 0, rows - 1), np.clip(col, 0, cols - 1)]
+        return hit | ~inside
+
+    def clearance(self, point):
+        """Signed distance to the nearest expanded obstacle boundary at a
+        point (or (M, 2) array of points); -inf outside the grid."""
+        row, col = self.world_to_cell(point)
+        inside = self.in_bounds(row, col)
+        rows, cols = self.shape
+        d = self.sdf[np.clip(row, 0, rows - 1), np.clip(col, 0, cols - 1)]
+        return np.where(inside, d, -np.inf)
+
+
+def signed_distance_field(occupancy, resolution):
+    """Euclidean distance to the nearest occupied cell for free cells, minus
+    the distance to the nearest free cell for occupied ones."""
+    if not occupancy.any():
+        return np.full(occupancy.shape, np.inf)
+    outside = ndimage.distance_transform_edt(~occupancy) * resolution
+    if occupancy.all():
+        return np.full(occupancy.shape, -np.inf)
+    inside = ndimage.distance_transform_edt(occupancy) * resolution
+    return outside - inside
+
+
+_MOVES = [(-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0)]
+_DIAGONAL_MOVES = [(-1, -1, math.sqrt(2)), (-1, 1, math.sqrt(2)), (1, -1, math.sqrt(2)), (1, 1, math.sqrt(2))]
+
+
+def grid_astar(grid, start, goal, diagonal=True, clearance_weight=0.0):
+    """A* over the free cells of an OccupancyGrid from the cell containing
+    start to the cell containing goal. Diagonal moves may not cut corners.
+
+    The cost of a move is its length times (1 + clearance_weight / d) where d
+    is the clearance of the target cell (clamped below at one cell), so a
+    positive clearance_weight trades length for distance from obstacles.
+    Returns a search_classes.Path over cell centers, or None if the goal is
+    unreachable or start/goal are in collision."""
+    rows, cols = grid.shape
+    res = grid.resolution
+    start_cell = tuple(int(v) for v in grid.world_to_cell(start))
+    goal_cell = tuple(int(v) for v in grid.world_to_cell(goal))
+    occupancy = grid.occupancy
+    for r, c in (start_cell, goal_cell):
+        if not grid.in_bounds(r, c) or occupancy[r, c]:
+            return None
+    moves = _MOVES + (_DIAGONAL_MOVES if diagonal else [])
+    if clearance_weight:
+        penalty = 1.0 + clearance_weight / np.maximum(grid.sdf, res)
+    else:
+        penalty = None
+
+    gr, gc = goal_cell
+    def h(cell):
+        dr, dc = abs(cell[0] - gr), abs(cell[1] - gc)
+        if diagonal:
+            return res * (max(dr, dc) + (math.sqrt(2) - 1) * min(dr, dc))
+        return res * (dr + dc)
+
+    g = {start_cell: 0.0}
+    parent = {start_cell: None}
+    frontier = PriorityQueue(min, lambda cell: g[cell] + h(cell))
+    frontier.append(start_cell)
+    closed = set()
+    while len(frontier):
+        cell = frontier.pop()
+        if cell == goal_cell:
+            break
+        closed.add(cell)
+        r, c = cell
+        for dr, dc, length in moves:
+            nr, nc = r + dr, c + dc
+            if nr < 0 or nr >= rows or nc < 0 or nc >= cols or occupancy[nr, nc]:
+                continue
+            if dr and dc and (occupancy[r, nc] or occupancy[nr, c]):
+                continue
+            child = (nr, nc)
+            if child in closed:
+                continue
+            step = length * res
+            if penalty is not None:
+                step *= penalty[nr, nc]
+            cost = g[cell] + step
+            if cost < g.get(child, math.inf):
+                g[child] = cost
+                parent[child] = cell
+                frontier.append(child)
+    else:
+        return None
+
+    chain = []
+    cell = goal_cell
+    while cell is not None:
+        chain.append(cell)
+        cell = parent[cell]
+    node = None
+    for cell in reversed(chain):
+        node = SearchNode(grid.cell_to_world(cell), node, g[cell], cell)
+    return Path(node)
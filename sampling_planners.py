@@ -0,0 +1,245 @@
+import math
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from graph import Graph
+from search import astar_search, euclidean_heuristic
+from search_classes import NodePool, Path
+
+
+def _rng(seed):
+    return seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+
+def sample_free(env, n, rng, bounds=None, batch_size=1024):
+    """Draw n collision-free points uniformly from bounds (default
+    env.bounds), testing them against the expanded obstacles a batch at a
+    time. Returns an (n, 2) array."""
+    minx, miny, maxx, maxy = bounds if bounds is not None else env.bounds
+    out, have, tries = [], 0, 0
+    while have < n:
+        batch = rng.uniform((minx, miny), (maxx, maxy), size=(max(batch_size, n - have), 2))
+        free = batch[~env.points_in_collision(batch)]
+        out.append(free)
+        have += len(free)
+        tries += 1
+        if tries >= 100 and not have:
+            raise Exception("No free space found in %s" % ((minx, miny, maxx, maxy),))
+    return np.vstack(out)[:n]
+
+
+class PRM:
+    """Probabilistic roadmap over an Environment's expanded obstacles.
+
+    n_samples free points are drawn in batches and each is joined to its k
+    nearest neighbours (found with a k-d tree) when the straight segment
+    between them is free; all candidate edges are checked in one batched
+    call. The roadmap is a graph.Graph over (x, y) tuples, so it can be
+    queried repeatedly, frozen, or drawn.
+
+    With a search_classes.SearchStats as stats, the collision checks made
+    while building the roadmap, connecting query points and searching are
+    counted into it, along with their time."""
+    def __init__(self, env, n_samples=1000, k=10, seed=None, bounds=None, stats=None):
+        self.env = env
+        self.k = k
+        self.rng = _rng(seed)
+        self.stats = stats
+        t = time.perf_counter()
+        self.points = sample_free(env, n_samples, self.rng, bounds)
+        if stats is not None:
+            stats.add_time('sampling', time.perf_counter() - t)
+        self.tree = cKDTree(self.points)
+        self.roadmap = Graph()
+        for p in self.points:
+            self.roadmap.add_node(tuple(p))
+        k = min(k + 1, len(self.points))
+        if k < 2:
+            return
+        _, nbrs = self.tree.query(self.points, k=k)
+        i = np.repeat(np.arange(len(self.points)), k - 1)
+        j = nbrs[:, 1:].ravel()
+        pairs = np.unique(np.sort(np.column_stack([i, j]), axis=1), axis=0)
+        self._add_edges(self.points[pairs[:, 0]], self.points[pairs[:, 1]])
+
+    def _add_edges(self, a, b):
+        t = time.perf_counter()
+        free = ~self.env.segments_in_collision(a, b)
+        if self.stats is not None:
+            self.stats.collision_checks += len(a)
+            self.stats.add_time('collision', time.perf_counter() - t)
+        lengths = np.hypot(*(a - b).T)
+        for p, q, w in zip(a[free], b[free], lengths[free]):
+            self.roadmap.add_edge(tuple(p), tuple(q), float(w))
+
+    def connect(self, point):
+        """Add point to the roadmap, joined to its k nearest samples."""
+        point = tuple(float(c) for c in point[:2])
+        if self.stats is not None:
+            self.stats.collision_checks += 1
+        if self.env.point_in_collision(point):
+            return None
+        self.roadmap.add_node(point)
+        _, nbrs = self.tree.query(point, k=min(self.k, len(self.points)))
+        nbrs = np.atleast_1d(nbrs)
+        self._add_edges(np.repeat([point], len(nbrs), axis=0), self.points[nbrs])
+        return point
+
+    def query(self, start, goal):
+        """Shortest roadmap path from start to goal, or None."""
+        start, goal = self.connect(start), self.connect(goal)
+        if start is None or goal is None:
+            return None
+        return astar_search(self.roadmap, start, goal, euclidean_heuristic, self.stats)
+
+
+def rrt_star(env, start, goal, n_iterations=2000, step=0.5, goal_radius=0.5, goal_bias=0.05,
+             gamma=None, seed=None, bounds=None, batch_size=256, rebuild_every=64, stats=None):
+    """RRT* from start towards goal. Returns a Path ending exactly at goal,
+    or None if no tree node within goal_radius can see the goal.
+
+    Samples are drawn batch_size at a time. Nearest and radius-neighbour
+    queries use a k-d tree over the tree nodes, rebuilt every rebuild_every
+    insertions, plus a brute-force scan of the nodes added since. Each new
+    node's neighbourhood is collision checked in one batched call, and the
+    result serves both for choosing its parent and for rewiring. gamma
+    scales the rewiring radius gamma*sqrt(log(n)/n) (capped at step); by
+    default it is the usual lower bound for the area of bounds.
+
+    A search_classes.SearchStats passed as stats gets the iterations
+    (expanded), tree nodes (generated), rewirings (decreased) and collision
+    checks counted, and the time spent in collision checks, neighbour
+    queries and in total."""
+    clock = time.perf_counter
+    t_start = clock()
+    t_collision = t_near = 0.0
+    rng = _rng(seed)
+    start = tuple(float(c) for c in start[:2])
+    goal = tuple(float(c) for c in goal[:2])
+    if stats is not None:
+        stats.collision_checks += 2
+    if env.point_in_collision(start) or env.point_in_collision(goal):
+        return None
+    minx, miny, maxx, maxy = bounds if bounds is not None else env.bounds
+    if gamma is None:
+        gamma = 2 * math.sqrt(1.5 * (maxx - minx) * (maxy - miny) / math.pi)
+
+    pool = NodePool()
+    pool.add(start)
+    children = [[]]
+    xy = np.empty((n_iterations + 1, 2))
+    xy[0] = start
+    tree, indexed = None, 0
+    best_goal, best_cost = -1, math.inf
+
+    def near(p, r):
+        n = len(pool)
+        tail = np.arange(indexed, n)
+        d = np.hypot(*(xy[indexed:n] - p).T)
+        if tree is None:
+            return tail[d <= r], tail[np.argmin(d)]
+        idx = np.array(tree.query_ball_point(p, r), dtype=np.int64)
+        nearest_d, nearest = tree.query(p)
+        if len(d) and d.min() < nearest_d:
+            nearest = tail[np.argmin(d)]
+        return np.concatenate([idx, tail[d <= r]]), int(nearest)
+
+    def propagate(i, delta):
+        stack = list(children[i])
+        while stack:
+            c = stack.pop()
+            pool.costs[c] -= delta
+            stack.extend(children[c])
+
+    samples = np.empty((0, 2))
+    for _ in range(n_iterations):
+        if not len(samples):
+            samples = rng.uniform((minx, miny), (maxx, maxy), size=(batch_size, 2))
+            use_goal = rng.random(batch_size) < goal_bias
+            samples[use_goal] = goal
+        sample, samples = samples[0], samples[1:]
+
+        n = len(pool)
+        r = min(step, gamma * math.sqrt(math.log(n + 1) / (n + 1)))
+        t = clock()
+        _, nearest = near(sample, 0.0)
+        t_near += clock() - t
+        direction = sample - xy[nearest]
+        dist = math.hypot(direction[0], direction[1])
+        new = sample if dist <= step else xy[nearest] + direction * (step / dist)
+        if stats is not None:
+            stats.expanded += 1
+            stats.collision_checks += 1
+        t = clock()
+        blocked = env.segment_in_collision(xy[nearest], new)
+        t_collision += clock() - t
+        if blocked:
+            continue
+
+        t = clock()
+        nbrs, _ = near(new, r)
+        nbrs = np.union1d(nbrs, [nearest])
+        t_near += clock() - t
+        lengths = np.hypot(*(xy[nbrs] - new).T)
+        t = clock()
+        free = ~env.segments_in_collision(xy[nbrs], np.repeat([new], len(nbrs), axis=0))
+        t_collision += clock() - t
+        if stats is not None:
+            stats.collision_checks += len(nbrs)
+        nbr_costs = np.frombuffer(pool.costs, dtype=np.float64)[nbrs] + lengths
+        nbr_costs[~free] = np.inf
+        k = int(np.argmin(nbr_costs))
+        if not np.isfinite(nbr_costs[k]):
+            continue
+        parent = int(nbrs[k])
+        i = pool.add((float(new[0]), float(new[1])), parent, float(nbr_costs[k]))
+        if stats is not None:
+            stats.generated += 1
+        children.append([])
+        children[parent].append(i)
+        xy[i] = new
+
+        # Rewire neighbours that are cheaper to reach through the new node.
+        for j, length, ok in zip(nbrs.tolist(), lengths.tolist(), free.tolist()):
+            through = pool.costs[i] + length
+            if ok and j != parent and through < pool.costs[j]:
+                children[pool.parents[j]].remove(j)
+                children[i].append(j)
+                delta = pool.costs[j] - through
+                pool.parents[j] = i
+                pool.costs[j] = through
+                propagate(j, delta)
+                if stats is not None:
+                    stats.decreased += 1
+
+        if len(pool) - indexed >= rebuild_every:
+            tree, indexed = cKDTree(xy[:len(pool)]), len(pool)
+
+    # Best node that reaches the goal in a straight line.
+    n = len(pool)
+    d = np.hypot(*(xy[:n] - goal).T)
+    close = np.nonzero(d <= goal_radius)[0]
+    if len(close):
+        if stats is not None:
+            stats.collision_checks += len(close)
+        free = ~env.segments_in_collision(xy[close], np.repeat([goal], len(close), axis=0))
+        totals = np.frombuffer(pool.costs, dtype=np.float64)[close] + d[close]
+        totals[~free] = np.inf
+        k = int(np.argmin(totals))
+        if np.isfinite(totals[k]):
+            best_goal, best_cost = int(close[k]), float(totals[k])
+    if best_goal < 0:
+        path = None
+    elif d[best_goal] == 0.0:
+        path = Path.from_pool(pool, best_goal)
+    else:
+        path = Path.from_pool(pool, pool.add(goal, best_goal, best_cost))
+    if stats is not None:
+        stats.add_time('collision', t_collision)
+        stats.add_time('nearest', t_near)
+        stats.add_time('total', clock() - t_start)
+        if path is not None:
+            path.stats = stats
+    return path
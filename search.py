@@ -0,0 +1,103 @@
+import math
+import time
+
+from search_classes import NodePool, Path
+from utils import PriorityQueue
+
+
+def euclidean_heuristic(state, goal):
+    """Straight-line distance between two (x, y) states."""
+    return math.hypot(state[0] - goal[0], state[1] - goal[1])
+
+
+def astar_search(graph, start, goal, heuristic=None, stats=None):
+    """A* from start to goal over any graph with a neighbors(node) method
+    yielding (target, weight) pairs -- a graph.Graph or a graph.FrozenGraph.
+    heuristic(state, goal) must not overestimate; without one this is
+    uniform cost search. Returns a Path, or None if goal is unreachable.
+
+    Nodes live in a NodePool; the frontier holds states, best maps each
+    state to the pool index of the cheapest node found for it so far and
+    closed flags expanded pool indices.
+
+    Passing a search_classes.SearchStats as stats fills it in (and calls
+    its trace per expansion), timing the frontier, the edge expansion and
+    the path reconstruction; without one the search only pays for the
+    checks that skip this."""
+    counting = stats is not None
+    clock = time.perf_counter
+    if counting:
+        t_start = clock()
+        t_pops = t_pushes = t_expansion = 0.0
+        trace = stats.trace
+    h = (lambda state: heuristic(state, goal)) if heuristic else (lambda state: 0.0)
+    pool = NodePool()
+    costs = pool.costs
+    best = {start: pool.add(start)}
+    closed = bytearray(1)
+    frontier = PriorityQueue(min, lambda state: costs[best[state]] + h(state))
+    frontier.append(start)
+    if counting:
+        stats.generated += 1
+        stats.pushes += 1
+        stats.peak_frontier = max(stats.peak_frontier, 1)
+    path = None
+    while len(frontier):
+        if counting:
+            t = clock()
+            state = frontier.pop()
+            t_pops += clock() - t
+            stats.pops += 1
+        else:
+            state = frontier.pop()
+        i = best[state]
+        if state == goal:
+            t = clock() if counting else 0.0
+            path = Path.from_pool(pool, i)
+            if counting:
+                stats.add_time('reconstruction', clock() - t)
+                path.stats = stats
+            break
+        closed[i] = 1
+        cost = costs[i]
+        if counting:
+            stats.expanded += 1
+            if trace is not None:
+                trace({'expansion': stats.expanded, 'state': state, 'g': cost, 'h': h(state),
+                       'frontier': len(frontier)})
+            t = clock()
+        for target, weight in graph.neighbors(state):
+            j = best.get(target)
+            if j is not None:
+                if closed[j]:
+                    if counting and cost + weight < costs[j]:
+                        stats.reopened += 1
+                    continue
+                if costs[j] <= cost + weight:
+                    continue
+                if counting:
+                    stats.decreased += 1
+            best[target] = pool.add(target, i, cost + weight)
+            closed.append(0)
+            if counting:
+                stats.generated += 1
+                stats.pushes += 1
+                t_push = clock()
+                frontier.append(target)
+                t_pushes += clock() - t_push
+            else:
+                frontier.append(target)
+        if counting:
+            t_expansion += clock() - t
+            if len(frontier) > stats.peak_frontier:
+                stats.peak_frontier = len(frontier)
+    if counting:
+        # Pushes happen inside the expansion loop; count them as frontier time.
+        stats.add_time('frontier', t_pops + t_pushes)
+        stats.add_time('expansion', t_expansion - t_pushes)
+        stats.add_time('total', clock() - t_start)
+    return path
+
+
+def uniform_cost_search(graph, start, goal, stats=None):
+    return astar_search(graph, start, goal, stats=stats)
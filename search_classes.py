@@ -1,4 +1,10 @@
+import json
+from array import array
+
+
 class SearchNode(object):
+    __slots__ = ('_parent', '_state', '_action', '_cost')
+
     def __init__(self, state, parent_node=None, cost=0.0, action=None):
         self._parent = parent_node
         self._state = state
@@ -38,9 +44,81 @@ class SearchNode(object):
     def __gt__(self,other):
         return self._cost > other._cost
 
+class NodePool(object):
+    """Array-backed storage for search nodes. Node i is described by
+    states[i] and the typed arrays parents[i] (-1 for a root) and
+    costs[i], so a search can refer to nodes by index instead of
+    allocating a SearchNode per expansion."""
+    def __init__(self):
+        self.states = []
+        self.parents = array('q')
+        self.costs = array('d')
+
+    def __len__(self):
+        return len(self.states)
+
+    def add(self, state, parent=-1, cost=0.0):
+        """Store a node and return its index."""
+        self.states.append(state)
+        self.parents.append(parent)
+        self.costs.append(cost)
+        return len(self.states) - 1
+
+
+class SearchStats(object):
+    """Counters filled in by a search that is handed one (astar_search,
+    rrt_star, PRM.query); the Path it returns refers back to them as
+    path.stats.
+
+    expanded/generated count nodes popped for expansion and nodes created,
+    pushes/pops/peak_frontier describe the frontier, decreased counts
+    queued states re-prioritised at a lower cost and reopened closed states
+    reached again at a lower cost (a sign of an inconsistent heuristic; A*
+    here does not reopen them). collision_checks counts points and
+    segments tested against obstacles. times maps phases ('frontier',
+    'expansion', 'reconstruction', 'total', ...) to wall time in seconds.
+
+    trace, if given, is called as trace(event) with a dict per expansion,
+    e.g. a trace_writer."""
+    def __init__(self, trace=None):
+        self.expanded = 0
+        self.generated = 0
+        self.pushes = 0
+        self.pops = 0
+        self.peak_frontier = 0
+        self.decreased = 0
+        self.reopened = 0
+        self.collision_checks = 0
+        self.times = {}
+        self.trace = trace
+
+    def add_time(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+
+    def as_dict(self):
+        d = dict((k, v) for k, v in self.__dict__.items() if k != 'trace')
+        d['times'] = dict(self.times)
+        return d
+
+    def __repr__(self):
+        return "<SearchStats %s>" % ", ".join("%s: %s" % kv for kv in sorted(self.as_dict().items()))
+
+
+def trace_writer(f):
+    """A SearchStats trace that writes each event to file f as a line of
+    JSON, for offline analysis."""
+    def write(event):
+        f.write(json.dumps(event, default=str))
+        f.write("\n")
+    return write
+
+
 class Path(object):
     """This class computes the path from the starting state until the state specified by the search_node
     parameter by iterating backwards."""
+    # The SearchStats of the search that produced the path, if it kept any.
+    stats = None
+
     def __init__(self, search_node):
         self.path = []
         node = search_node
@@ -50,6 +128,19 @@ class Path(object):
         self.path.reverse()
         self.cost = search_node.cost
 
+    @classmethod
+    def from_pool(cls, pool, i):
+        """The path to node i of a NodePool, followed through parent indices."""
+        path = cls.__new__(cls)
+        path.path = []
+        path.cost = pool.costs[i]
+        parents, states = pool.parents, pool.states
+        while i >= 0:
+            path.path.append(states[i])
+            i = parents[i]
+        path.path.reverse()
+        return path
+
     def __repr__(self):
         return "Path of length %d, cost: %.3f: %s" % (len(self.path),self.cost, self.path)
 
@@ -57,17 +148,5 @@ class Path(object):
         return zip(self.path[0:-1], self.path[1:])
 
     def display(self, graph):
-        dot_graph = graph._create_dot_graph()
-        for n in dot_graph.get_nodes():
-            if n.get_name() == self.path[0]:
-                n.set_color('blue')
-            elif n.get_name() == self.path[-1]:
-                n.set_color('green')
-            elif n.get_name() in self.path:
-                n.set_color('red')
-        edges = self.edges()
-        for e in dot_graph.get_edges():
-            if (e.get_source(), e.get_destination()) in edges:
-                e.set_color('red')
-        dot_graph.set_concentrate(False)
-        display_svg(dot_graph.create_svg(), raw=True)
+        from visualization import display_path
+        display_path(self, graph)
@@ -0,0 +1,88 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import yaml
+from shapely.geometry import Point, box
+
+import environment
+from environment import Environment, ObstacleIndex, read_binary_environment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def yaml_file(tmp_path):
+    """A copy of simple.yaml, so its compiled copy goes to tmp_path."""
+    path = str(tmp_path / 'simple.yaml')
+    shutil.copy(os.path.join(ROOT, 'simple.yaml'), path)
+    return path
+
+
+def test_contains_points_counts_boundary_points():
+    square = box(0, 0, 1, 1)
+    hole = box(0.25, 0.25, 0.75, 0.75)
+    index = ObstacleIndex([square.difference(hole)])
+    points = [(1, 1), (1, 0.5), (0.5, 1), (0, 0), (0, 0.5), (0.5, 0),
+              (0.75, 0.5), (0.25, 0.25), (0.5, 0.5), (0.1, 0.1), (1.5, 0.5), (0.5, -0.1)]
+    # point_in_collision is index.intersects(Point(p)).
+    expected = [index.intersects(Point(p)) for p in points]
+    assert index.contains_points(np.array(points)).tolist() == expected
+    assert expected == [True] * 8 + [False, True, False, False]
+
+
+def test_compiled_copy_from_another_format_is_a_cache_miss(yaml_file, monkeypatch):
+    cache = environment.binary_cache_path(yaml_file)
+    first = Environment(yaml_file)
+    assert read_binary_environment(cache)[0]['format'] == environment.BINARY_FORMAT
+    monkeypatch.setattr(environment, 'BINARY_FORMAT', environment.BINARY_FORMAT + 1)
+    assert not Environment(use_cache=False).load_from_binary(cache)
+    second = Environment(yaml_file)
+    assert [ob.wkt for ob in second.obstacles] == [ob.wkt for ob in first.obstacles]
+    assert read_binary_environment(cache)[0]['format'] == environment.BINARY_FORMAT
+
+
+def test_data_is_the_yaml_document(yaml_file):
+    with open(yaml_file) as f:
+        document = yaml.safe_load(f)
+    for _ in range(2):  # parsed, then from the compiled copy
+        env = Environment(yaml_file)
+        assert env.data == document
+        assert sorted(env.obstacles_map) == sorted(document['environment']['obstacles'])
+    assert Environment(None).data is None
+
+
+def _stored_cspaces(path):
+    header, arrays = read_binary_environment(path)
+    return dict(((radius, merged), arrays[prefix + 'coords'].tolist())
+                for radius, merged, prefix in header['cspaces'])
+
+
+def test_cspace_after_add_obstacles_leaves_compiled_copy_alone(yaml_file):
+    cache = environment.binary_cache_path(yaml_file)
+    env = Environment(yaml_file)
+    env.cspace(0.5)
+    before = _stored_cspaces(cache)
+    assert list(before) == [(0.5, False)]
+    env.add_obstacles([box(100, 100, 101, 101)])
+    env.cspace(0.75)
+    env.cspace(0.5, merged=True)
+    assert _stored_cspaces(cache) == before
+    again = Environment(yaml_file)
+    assert len(again.obstacles) == len(env.obstacles) - 1
+    assert len(again.cspace(0.5)[0]) == len(again.obstacles)
+
+
+def test_bounds_are_not_persisted(yaml_file):
+    cache = environment.binary_cache_path(yaml_file)
+    obstacles = Environment(yaml_file).obstacles
+    xs = [x for ob in obstacles for x in ob.exterior.xy[0]]
+    ys = [y for ob in obstacles for y in ob.exterior.xy[1]]
+    vertex_bounds = [min(xs), min(ys), max(xs), max(ys)]
+    os.remove(cache)
+    env = Environment(yaml_file, bounds=(-50, -50, 50, 50))
+    assert env.bounds == (-50, -50, 50, 50)
+    env.cspace(0.5)
+    assert read_binary_environment(cache)[0]['bounds'] == vertex_bounds
+    assert Environment(yaml_file).bounds != (-50, -50, 50, 50)
@@ -0,0 +1,30 @@
+import pytest
+
+from graph import Graph, NodeNotInGraph
+from search import astar_search
+
+
+def test_remove_node_drops_one_way_in_edges():
+    g = Graph()
+    g.add_edge(1, 2, bidirectional=False)
+    g.add_edge(2, 3)
+    g.remove_node(2)
+    assert 2 not in g
+    assert all(e.target != 2 for edges in g._edges.values() for e in edges)
+    frozen = g.freeze()
+    assert sorted(frozen.labels) == [1, 3]
+    assert g.distance_matrix([1], [3])[0][0] == float('inf')
+    assert astar_search(g, 1, 3) is None
+    with pytest.raises(NodeNotInGraph):
+        g.remove_node(2)
+
+
+def test_remove_edge_bumps_version_only_when_removing():
+    g = Graph()
+    g.add_edge(1, 2)
+    version = g.version
+    g.remove_edge(1, 3)
+    assert g.version == version
+    g.remove_edge(1, 2, bidirectional=False)
+    assert g.version > version
+    assert [e.target for e in g.node_edges(2)] == [1]
@@ -0,0 +1,28 @@
+import os
+import shutil
+
+import numpy as np
+from shapely.geometry import box
+
+from environment import Environment
+from occupancy_grid import OccupancyGrid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_from_environment_does_not_serve_a_stale_grid(tmp_path):
+    yaml_file = str(tmp_path / 'simple.yaml')
+    shutil.copy(os.path.join(ROOT, 'simple.yaml'), yaml_file)
+    cache_dir = str(tmp_path / 'grids')
+    env = Environment(yaml_file)
+    first = OccupancyGrid.from_environment(env, 0.25, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    minx, miny, _, _ = env.bounds
+    env.add_obstacles([box(minx, miny, minx + 2, miny + 2)])
+    edited = OccupancyGrid.from_environment(env, 0.25, bounds=first.bounds, cache_dir=cache_dir)
+    fresh = OccupancyGrid.rasterize(env, 0.25, first.bounds)
+    assert np.array_equal(edited.occupancy, fresh.occupancy)
+    assert edited.occupancy.sum() > first.occupancy.sum()
+    assert len(os.listdir(cache_dir)) == 1
+    reloaded = OccupancyGrid.from_environment(Environment(yaml_file), 0.25, cache_dir=cache_dir)
+    assert np.array_equal(reloaded.occupancy, first.occupancy)
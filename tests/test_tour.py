@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from graph import Graph
+from tour import held_karp, plan_tour, solve_tour
+
+
+def _unreachable(n=6, goal=3):
+    """Unit distances between n stops, except that nothing leads to goal."""
+    dist = np.ones((n, n)) - np.eye(n)
+    dist[:, goal] = np.inf
+    dist[goal, goal] = 0.0
+    return dist
+
+
+def _line(n):
+    """Nodes 0..n-1 joined in a row by unit edges."""
+    g = Graph()
+    for a in range(n - 1):
+        g.add_edge(a, a + 1)
+    return g
+
+
+@pytest.mark.parametrize('closed', [False, True])
+def test_held_karp_unreachable_goal(closed):
+    assert held_karp(_unreachable(), closed) is None
+
+
+def test_held_karp_cannot_return_to_start():
+    dist = np.ones((4, 4)) - np.eye(4)
+    dist[1:, 0] = np.inf
+    assert held_karp(dist)[1] == 3.0
+    assert held_karp(dist, closed=True) is None
+
+
+@pytest.mark.parametrize('exact_limit', [12, 0])
+def test_solve_tour_unreachable_goal(exact_limit):
+    assert solve_tour(_unreachable(), exact_limit=exact_limit, time_budget=0.1) is None
+
+
+@pytest.mark.parametrize('exact_limit', [12, 0])
+def test_solve_tour_reachable_goals(exact_limit):
+    dist = _line(6).distance_matrix(list(range(6)))
+    order, cost = solve_tour(dist, exact_limit=exact_limit, time_budget=0.1)
+    assert order == [1, 2, 3, 4, 5] and cost == 5.0
+
+
+@pytest.mark.parametrize('exact_limit', [12, 0])
+def test_plan_tour_disconnected_goal(exact_limit):
+    g = _line(5)
+    g.add_edge(10, 11)
+    assert plan_tour(g, 0, [4, 2, 11], exact_limit=exact_limit, time_budget=0.1) is None
+    path, order = plan_tour(g, 0, [4, 2], exact_limit=exact_limit, time_budget=0.1)
+    assert order == [2, 4]
+    assert path.path == [0, 1, 2, 3, 4] and path.cost == 4.0
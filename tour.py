@@ -0,0 +1,212 @@
+"""Ordering a route through several goals.
+
+Tours are computed on a cost matrix whose row and column 0 is the start and
+1..k are the goals (e.g. from Graph.distance_matrix([start] + goals)). A
+tour is a list of goal indices in visiting order. Open tours end at the
+last goal; closed ones return to the start.
+"""
+import time
+
+import numpy as np
+
+from search import astar_search
+from search_classes import SearchNode, Path
+
+
+def tour_cost(dist, order, closed=False):
+    """Cost of visiting the goals of dist in order."""
+    stops = [0] + list(order) + ([0] if closed else [])
+    return float(sum(dist[a, b] for a, b in zip(stops[:-1], stops[1:])))
+
+
+def held_karp(dist, closed=False):
+    """Exact (order, cost) by dynamic programming over subsets of goals:
+    O(2^k k^2) time and O(2^k k) memory, so keep k to a dozen or so.
+    None if some goal cannot be reached (or, if closed, left again)."""
+    dist = np.asarray(dist, dtype=float)
+    k = len(dist) - 1
+    if k <= 0:
+        return [], 0.0
+    between = dist[1:, 1:]
+    full = (1 << k) - 1
+    dp = np.full((full + 1, k), np.inf)
+    parent = np.full((full + 1, k), -1, dtype=np.int8 if k < 128 else np.int32)
+    goals = np.arange(k)
+    dp[1 << goals, goals] = dist[0, 1:]
+    for mask in range(1, full):
+        row = dp[mask]
+        outside = goals[(mask >> goals) & 1 == 0]
+        via = row[:, None] + between[:, outside]
+        best = via.argmin(axis=0)
+        targets = mask | (1 << outside)
+        dp[targets, outside] = via[best, np.arange(len(outside))]
+        parent[targets, outside] = best
+    final = dp[full] + (dist[1:, 0] if closed else 0.0)
+    j = int(final.argmin())
+    cost = float(final[j])
+    if not np.isfinite(cost):
+        return None
+    order, mask = [], full
+    while j >= 0:
+        order.append(j + 1)
+        mask, j = mask ^ (1 << j), int(parent[mask, j])
+    order.reverse()
+    return order, cost
+
+
+def nearest_neighbor_tour(dist):
+    """Greedy order: always go to the closest unvisited goal."""
+    k = len(dist) - 1
+    left = set(range(1, k + 1))
+    order, here = [], 0
+    while left:
+        here = min(left, key=lambda j: (dist[here, j], j))
+        order.append(here)
+        left.discard(here)
+    return order
+
+
+def insert_goals(dist, order, goals):
+    """Add goals to order, each at the position where it costs least."""
+    order = list(order)
+    for g in goals:
+        stops = [0] + order
+        best, best_at = np.inf, len(order)
+        for at in range(len(stops)):
+            a = stops[at]
+            b = stops[at + 1] if at + 1 < len(stops) else None
+            extra = dist[a, g] + (dist[g, b] - dist[a, b] if b is not None else 0.0)
+            if extra < best:
+                best, best_at = extra, at
+        order.insert(best_at, g)
+    return order
+
+
+def _local_matrix(dist, closed):
+    """dist padded with a fixed end node: a copy of the start for closed
+    tours, a free sink for open ones. Unreachable pairs become a large
+    finite penalty so move gains stay well defined."""
+    n = len(dist)
+    finite = dist[np.isfinite(dist)]
+    big = (finite.max() if len(finite) else 1.0) * (n + 1) + 1.0
+    d = np.full((n + 1, n + 1), big)
+    d[:n, :n] = np.where(np.isfinite(dist), dist, big)
+    d[:n, n] = dist[:, 0] if closed else 0.0
+    d[:n, n] = np.where(np.isfinite(d[:n, n]), d[:n, n], big)
+    return d
+
+
+def two_opt(d, tour, deadline):
+    """Reverse segments of tour (fixed first and last entries) while that
+    shortens it. Costs of reversed segments are summed in the reverse
+    direction, so asymmetric matrices are handled exactly."""
+    n = len(tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        t = np.array(tour)
+        fwd = np.concatenate([[0.0], np.cumsum(d[t[:-1], t[1:]])])
+        bwd = np.concatenate([[0.0], np.cumsum(d[t[1:], t[:-1]])])
+        for i in range(1, n - 2):
+            j = np.arange(i + 1, n - 1)
+            old = d[t[i-1], t[i]] + (fwd[j] - fwd[i]) + d[t[j], t[j+1]]
+            new = d[t[i-1], t[j]] + (bwd[j] - bwd[i]) + d[t[i], t[j+1]]
+            gain = old - new
+            best = int(gain.argmax())
+            if gain[best] > 1e-9:
+                jb = int(j[best])
+                tour[i:jb+1] = tour[i:jb+1][::-1]
+                improved = True
+                break
+    return tour
+
+
+def or_opt(d, tour, deadline, max_segment=3):
+    """Move runs of up to max_segment goals elsewhere in tour (fixed first
+    and last entries) while that shortens it."""
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        t = np.array(tour)
+        n = len(t)
+        for length in range(1, max_segment + 1):
+            for i in range(1, n - length):
+                a, first, last, b = t[i-1], t[i], t[i+length-1], t[i+length]
+                removed = d[a, first] + d[last, b] - d[a, b]
+                rest = np.concatenate([t[:i], t[i+length:]])
+                p, q = rest[:-1], rest[1:]
+                added = d[p, first] + d[last, q] - d[p, q]
+                added[i-1] = np.inf  # Putting it back where it was.
+                at = int(added.argmin())
+                if removed - added[at] > 1e-9:
+                    tour[:] = list(rest[:at+1]) + list(t[i:i+length]) + list(rest[at+1:])
+                    improved = True
+                    break
+            if improved:
+                break
+    return tour
+
+
+def solve_tour(dist, closed=False, exact_limit=12, time_budget=1.0, initial=None):
+    """Best (order, cost) found for the goals of dist.
+
+    Up to exact_limit goals the order is optimal (held_karp). Beyond that
+    the search starts from initial (goals it leaves out are inserted
+    cheaply) or the nearest neighbour order, and alternates 2-opt and
+    Or-opt until neither improves or time_budget seconds have passed.
+    Passing the previous order as initial makes re-solving after adding a
+    few goals cheap. None if no order visits every goal."""
+    dist = np.asarray(dist, dtype=float)
+    k = len(dist) - 1
+    if k <= exact_limit:
+        return held_karp(dist, closed)
+    deadline = time.perf_counter() + time_budget
+    if initial is None:
+        order = nearest_neighbor_tour(dist)
+    else:
+        order = [g for g in initial if 0 < g <= k]
+        known = set(order)
+        order = insert_goals(dist, order, [g for g in range(1, k + 1) if g not in known])
+    d = _local_matrix(dist, closed)
+    tour = [0] + order + [k + 1]
+    while time.perf_counter() < deadline:
+        before = tour_cost(d, tour[1:], False)
+        two_opt(d, tour, deadline)
+        or_opt(d, tour, deadline)
+        if tour_cost(d, tour[1:], False) >= before - 1e-9:
+            break
+    order = tour[1:-1]
+    cost = tour_cost(dist, order, closed)
+    if not np.isfinite(cost):
+        return None
+    return order, cost
+
+
+def plan_tour(graph, start, goals, closed=False, heuristic=None, previous=None, exact_limit=12,
+              time_budget=1.0, processes=1):
+    """Shortest route found from start through every goal on graph (and
+    back to start if closed). previous is an earlier visiting order of
+    (some of) the goals to warm-start from. Returns (path, order) where
+    path is a Path over graph nodes and order the goals in visiting order,
+    or None if some goal cannot be reached."""
+    goals = list(goals)
+    dist = graph.distance_matrix([start] + goals, processes=processes)
+    initial = None
+    if previous is not None:
+        position = {g: i + 1 for i, g in enumerate(goals)}
+        initial = [position[g] for g in previous if g in position]
+    solved = solve_tour(dist, closed, exact_limit, time_budget, initial)
+    if solved is None:
+        return None
+    order, cost = solved
+    stops = [start] + [goals[i - 1] for i in order] + ([start] if closed else [])
+    node = SearchNode(start)
+    for a, b in zip(stops[:-1], stops[1:]):
+        leg = astar_search(graph, a, b, heuristic)
+        for state in leg.path[1:]:
+            node = SearchNode(state, node, node.cost + _edge_cost(graph, node.state, state))
+    return Path(node), [goals[i - 1] for i in order]
+
+
+def _edge_cost(graph, a, b):
+    return min(w for target, w in graph.neighbors(a) if target == b)
@@ -17,8 +17,6 @@ If you find this software useful, it would be nice if you let me (peter@norvig.c
 http://www.norvig.com/license.html
 """
 
-import bisect
-
 
 def test_ok():
     try:
@@ -79,27 +77,99 @@ class PriorityQueue(Queue):
     """A queue in which the minimum (or maximum) element (as determined by f and
     order) is returned first. If order is min, the item with minimum f(x) is
     returned first; if order is max, then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+
+    The queue is an indexed binary heap: A holds [f(x), count, x] entries and
+    index maps each item to its slot in A, so append/pop/del are O(log n) and
+    membership is O(1). Items must be hashable, and equal items share a slot:
+    appending an item that is already queued replaces it (decrease-key).
+    Ties on f(x) are broken first-in first-out."""
     def __init__(self, order=min, f=lambda x: x):
-        update(self, A=[], order=order, f=f)
+        update(self, A=[], index={}, order=order, f=f, counter=0)
+        if order == min:
+            self._before = lambda a, b: a[0] < b[0] or (a[0] == b[0] and a[1] < b[1])
+        else:
+            self._before = lambda a, b: a[0] > b[0] or (a[0] == b[0] and a[1] < b[1])
     def append(self, item):
-        bisect.insort(self.A, (self.f(item), item))
+        entry = [self.f(item), self.counter, item]
+        self.counter += 1
+        i = self.index.get(item)
+        if i is None:
+            self.A.append(entry)
+            self.index[item] = len(self.A) - 1
+            self._sift_up(len(self.A) - 1)
+        else:
+            self._replace(i, entry)
+    def decrease_key(self, item):
+        """Re-prioritise item, which must already be in the queue."""
+        self._replace(self.index[item], [self.f(item), self.counter, item])
+        self.counter += 1
     def __len__(self):
         return len(self.A)
     def pop(self):
-        if self.order == min:
-            return self.A.pop(0)[1]
-        else:
-            return self.A.pop()[1]
+        return self._remove(0)[2]
+    def peek(self):
+        """Return the top item without removing it."""
+        return self.A[0][2]
     def __contains__(self, item):
-        return some(lambda x : x[1] == item, self.A)
+        return item in self.index
     def __getitem__(self, key):
-        for _, item in self.A:
-            if item == key:
-                return item
+        i = self.index.get(key)
+        if i is not None:
+            return self.A[i][2]
     def __delitem__(self, key):
-        for i, (value, item) in enumerate(self.A):
-            if item == key:
-                self.A.pop(i)
-                return
-
+        i = self.index.get(key)
+        if i is not None:
+            self._remove(i)
+
+    def _replace(self, i, entry):
+        old = self.A[i]
+        del self.index[old[2]]
+        self.A[i] = entry
+        self.index[entry[2]] = i
+        if self._before(entry, old):
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+    def _remove(self, i):
+        A = self.A
+        entry = A[i]
+        del self.index[entry[2]]
+        last = A.pop()
+        if i < len(A):
+            A[i] = last
+            self.index[last[2]] = i
+            if self._before(last, entry):
+                self._sift_up(i)
+            else:
+                self._sift_down(i)
+        return entry
+    def _sift_up(self, i):
+        A, index, before = self.A, self.index, self._before
+        entry = A[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not before(entry, A[parent]):
+                break
+            A[i] = A[parent]
+            index[A[i][2]] = i
+            i = parent
+        A[i] = entry
+        index[entry[2]] = i
+    def _sift_down(self, i):
+        A, index, before = self.A, self.index, self._before
+        n = len(A)
+        entry = A[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and before(A[child + 1], A[child]):
+                child += 1
+            if not before(A[child], entry):
+                break
+            A[i] = A[child]
+            index[A[i][2]] = i
+            i = child
+        A[i] = entry
+        index[entry[2]] = i
@@ -0,0 +1,228 @@
+import itertools
+import math
+import multiprocessing
+
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely.geometry import LineString, Point
+
+from environment import ObstacleIndex
+from graph import Graph
+
+
+def blocking_obstacle(index, a, b):
+    """Position in index of an obstacle whose interior the segment a-b
+    passes through, or None if a and b can see each other. Running along an
+    obstacle's boundary or grazing a vertex does not block."""
+    line = LineString([a, b])
+    for i in index.candidates(line):
+        p = index.prepared[i]
+        if p.intersects(line) and not p.touches(line):
+            return i
+    return None
+
+
+_worker_index = None
+
+def _init_worker(polygons):
+    global _worker_index
+    _worker_index = ObstacleIndex(polygons)
+
+def _check_pairs(pairs):
+    return [(a, b, blocking_obstacle(_worker_index, a, b)) for a, b in pairs]
+
+
+class VisibilityGraph:
+    """Visibility roadmap over a set of obstacles (normally
+    Environment.expanded_obstacles), kept as a graph.Graph in self.graph.
+
+    Nodes are (x, y) vertex tuples of the obstacles plus any query points,
+    edges join mutually visible nodes and are weighted by length. Vertices
+    lying inside another obstacle are left out. If max_distance is given only
+    pairs closer than that are considered, which turns the full visibility
+    graph into a much sparser roadmap.
+
+    The graph can be updated in place with add_obstacle/remove_obstacle. Each
+    rejected pair remembers one obstacle that blocked it, so removing an
+    obstacle only rechecks the pairs it was blocking, and adding one only
+    rechecks the edges whose bounding box it overlaps."""
+    def __init__(self, obstacles=(), max_distance=None, processes=1):
+        self.max_distance = max_distance
+        self.processes = processes
+        self.graph = Graph()
+        self.obstacles = {}
+        self.owners = {}
+        self.covers = {}
+        self.covered_by = {}
+        self.blocked_by = {}
+        self.queries = set()
+        self._next_id = 0
+        for polygon in obstacles:
+            self.obstacles[self._new_id()] = polygon
+        self._rebuild_index()
+        for oid, polygon in self.obstacles.items():
+            for v in self._polygon_vertices(polygon):
+                self.owners.setdefault(v, set()).add(oid)
+        for v in self.owners:
+            self._update_cover(v)
+        active = [v for v in self.owners if self.is_active(v)]
+        self._connect(active, active)
+
+    @classmethod
+    def from_environment(cls, env, start=None, goal=None, **kwargs):
+        vg = cls(env.expanded_obstacles, **kwargs)
+        for p in (start, goal):
+            if p is not None:
+                vg.add_query_point(p)
+        return vg
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _rebuild_index(self):
+        self._oids = list(self.obstacles)
+        self.index = ObstacleIndex([self.obstacles[oid] for oid in self._oids])
+
+    @staticmethod
+    def _polygon_vertices(polygon):
+        vertices = []
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            vertices.extend(tuple(c[:2]) for c in ring.coords[:-1])
+        return vertices
+
+    def _cover(self, v, oid):
+        self.covers.setdefault(v, set()).add(oid)
+        self.covered_by.setdefault(oid, set()).add(v)
+
+    def _update_cover(self, v):
+        """Record which obstacles have v strictly inside them."""
+        point = Point(v)
+        for i in self.index.candidates(point):
+            if self.index.prepared[i].contains_properly(point):
+                self._cover(v, self._oids[i])
+
+    def is_active(self, v):
+        """A vertex or query point is a graph node unless an obstacle covers it."""
+        return (v in self.owners or v in self.queries) and not self.covers.get(v)
+
+    def active_nodes(self):
+        return list(self.graph._nodes)
+
+    def _candidate_pairs(self, sources, targets):
+        """Unordered pairs (a, b), a in sources, b in targets, a != b, within
+        max_distance."""
+        sources, targets = list(sources), list(targets)
+        if not sources or not targets:
+            return []
+        if self.max_distance is None:
+            pairs = set()
+            for a in sources:
+                for b in targets:
+                    if a != b:
+                        pairs.add((a, b) if a < b else (b, a))
+            return list(pairs)
+        tree = cKDTree(np.array(targets))
+        pairs = set()
+        for a, near in zip(sources, tree.query_ball_point(np.array(sources), self.max_distance)):
+            for j in near:
+                b = targets[j]
+                if a != b:
+                    pairs.add((a, b) if a < b else (b, a))
+        return list(pairs)
+
+    def _check(self, pairs):
+        if self.processes > 1 and len(pairs) > 1000:
+            polygons = [self.obstacles[oid] for oid in self._oids]
+            chunks = [pairs[i::self.processes * 4] for i in range(self.processes * 4)]
+            with multiprocessing.Pool(self.processes, _init_worker, (polygons,)) as pool:
+                return list(itertools.chain.from_iterable(pool.map(_check_pairs, chunks)))
+        return [(a, b, blocking_obstacle(self.index, a, b)) for a, b in pairs]
+
+    def _connect(self, sources, targets):
+        """Add nodes for sources and visibility edges between sources and targets."""
+        for v in sources:
+            self.graph.add_node(v)
+            self.graph.set_node_pos(v, v)
+        for a, b, blocker in self._check(self._candidate_pairs(sources, targets)):
+            if blocker is None:
+                self.graph.add_edge(a, b, math.hypot(a[0] - b[0], a[1] - b[1]))
+            else:
+                self.blocked_by.setdefault(self._oids[blocker], set()).add((a, b))
+
+    def _drop(self, v):
+        if v in self.graph:
+            self.graph.remove_node(v)
+
+    def add_query_point(self, p):
+        """Add a start/goal point and connect it to every node it can see."""
+        v = tuple(p[:2]) if not isinstance(p, Point) else (p.x, p.y)
+        self.queries.add(v)
+        self._update_cover(v)
+        if self.is_active(v) and v not in self.graph:
+            self._connect([v], self.active_nodes())
+        return v
+
+    def remove_query_point(self, v):
+        self.queries.discard(v)
+        if v not in self.owners:
+            self._drop(v)
+
+    def add_obstacle(self, polygon):
+        """Insert an obstacle; returns its id for remove_obstacle."""
+        oid = self._new_id()
+        self.obstacles[oid] = polygon
+        self._rebuild_index()
+        minx, miny, maxx, maxy = polygon.bounds
+        # Nodes now swallowed by the new obstacle.
+        for v in list(self.owners) + list(self.queries):
+            if minx < v[0] < maxx and miny < v[1] < maxy and polygon.contains(Point(v)):
+                self._cover(v, oid)
+                self._drop(v)
+        # Edges now passing through it.
+        for a in list(self.graph._nodes):
+            for e in list(self.graph.node_edges(a)):
+                b = e.target
+                if a > b or max(a[0], b[0]) < minx or min(a[0], b[0]) > maxx \
+                        or max(a[1], b[1]) < miny or min(a[1], b[1]) > maxy:
+                    continue
+                line = LineString([a, b])
+                if polygon.intersects(line) and not polygon.touches(line):
+                    self.graph.remove_edge(a, b)
+                    self.blocked_by.setdefault(oid, set()).add((a, b))
+        # Its own vertices.
+        new = []
+        for v in self._polygon_vertices(polygon):
+            self.owners.setdefault(v, set()).add(oid)
+            self._update_cover(v)
+            if self.is_active(v) and v not in self.graph:
+                new.append(v)
+        self._connect(new, self.active_nodes() + new)
+        return oid
+
+    def remove_obstacle(self, oid):
+        """Remove an obstacle and repair only the edges it affected."""
+        polygon = self.obstacles.pop(oid)
+        self._rebuild_index()
+        for v in set(self._polygon_vertices(polygon)):
+            owners = self.owners.get(v, set())
+            owners.discard(oid)
+            if not owners:
+                self.owners.pop(v, None)
+                if not self.is_active(v):
+                    self._drop(v)
+        # Nodes that only this obstacle was covering come back.
+        uncovered = []
+        for v in self.covered_by.pop(oid, set()):
+            self.covers[v].discard(oid)
+            if self.is_active(v) and v not in self.graph:
+                uncovered.append(v)
+        self._connect(uncovered, self.active_nodes() + uncovered)
+        # Pairs that only this obstacle was blocking.
+        pairs = [(a, b) for a, b in self.blocked_by.pop(oid, set())
+                 if a in self.graph and b in self.graph]
+        for a, b, blocker in self._check(pairs):
+            if blocker is None:
+                self.graph.add_edge(a, b, math.hypot(a[0] - b[0], a[1] - b[1]))
+            else:
+                self.blocked_by.setdefault(self._oids[blocker], set()).add((a, b))
@@ -0,0 +1,227 @@
+"""Plotting and drawing for environments, graphs and paths.
+
+This is the only module that imports matplotlib, descartes, networkx and
+pydot_ng. The planning modules import it lazily from their draw/plot
+methods, so headless planners never load the plotting stack.
+
+render_png is the fast path for big scenes: every obstacle goes into one
+collection, roadmap edges into one line collection (thinned above
+max_edges), any number of paths into another, and the figure is written
+straight to a PNG without pyplot.
+"""
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection, PathCollection, PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.path import Path as MplPath
+from descartes import PolygonPatch
+import networkx as nx
+import pydot_ng as pydot
+
+from environment import _flatten_polygons
+
+
+def plot_environment(env, bounds=None, figsize=None):
+    if bounds is None and env.bounds:
+        minx, miny, maxx, maxy = env.bounds
+    elif bounds:
+        minx, miny, maxx, maxy = bounds
+    else:
+        minx, miny, maxx, maxy = (-10,-5,10,5)
+
+    max_width, max_height = 12, 5.5
+    if figsize is None:
+        width, height = max_width, (maxy-miny)*max_width/(maxx-minx)
+        if height > 5:
+            width, height = (maxx-minx)*max_height/(maxy-miny), max_height
+        figsize = (width, height)
+    #print(figsize)
+    f = plt.figure(figsize=figsize)
+    ax = f.add_subplot(111)
+    ax.add_collection(polygon_collection(env.obstacles, facecolor='blue', edgecolor='blue', alpha=0.5, zorder=20))
+
+    plt.xlim([minx, maxx])
+    plt.ylim([miny, maxy])
+    ax.set_aspect('equal', adjustable='box')
+    return ax
+
+def polygon_collection(polygons, **style):
+    """One matplotlib collection holding all polygons (with their holes),
+    built from their flattened coordinates."""
+    coords, ring_offsets, polygon_rings = _flatten_polygons(polygons)
+    rings = np.split(coords, ring_offsets[1:-1]) if len(coords) else []
+    if len(rings) == len(polygons):
+        return PolyCollection(rings, **style)
+    paths = [MplPath.make_compound_path(*[MplPath(rings[r], closed=True)
+                                          for r in range(polygon_rings[p], polygon_rings[p+1])])
+             for p in range(len(polygons))]
+    return PathCollection(paths, **style)
+
+
+def plot_line(ax, line):
+    x, y = line.xy
+    ax.plot(x, y, color='gray', linewidth=3, solid_capstyle='round', zorder=1)
+
+
+def plot_poly(ax, poly, color, alpha=1.0, zorder=1):
+    patch = PolygonPatch(poly, fc=color, ec="black", alpha=alpha, zorder=zorder)
+    ax.add_patch(patch)
+
+
+def draw_graph(graph, highlight_edges=None, label_limit=200):
+    """Draw graph with networkx. Node and edge labels are left out once
+    there are more than label_limit of them; use render_png for large
+    roadmaps."""
+    nxg = nx.DiGraph()
+    edges = [(e.source, e.target, {'weight':e.weight, 'inv_weight':1.0/e.weight}) for node_set in graph._edges.values() for e in node_set]
+    nxg.add_edges_from(edges)
+    if len(graph.node_positions) < len(graph._nodes):
+        # Calculate positions for nodes whose pos is not specified.
+        pos = nx.spring_layout(nxg, weight='inv_weight', pos=graph.node_positions or None, fixed=graph.node_positions.keys() if graph.node_positions else None)
+    else:
+        pos = graph.node_positions
+
+    f = plt.figure(figsize=(12,12))
+    plt.gca().set_aspect('equal', adjustable='box')
+    nx.draw_networkx_nodes(nxg, pos, node_color='w')
+    nx.draw_networkx_edges(nxg, pos, edges)
+    if nxg.number_of_nodes() <= label_limit:
+        nx.draw_networkx_labels(nxg, pos)
+    if nxg.number_of_edges() <= label_limit:
+        edge_labels=dict([((u,v,),"%s" % d['weight'])
+                 for u,v,d in nxg.edges(data=True)])
+        nx.draw_networkx_edge_labels(nxg, pos, edge_labels=edge_labels)
+
+
+    if highlight_edges:
+        nx.draw_networkx_edges(nxg, pos, highlight_edges, edge_color='r')
+
+    plt.axis('off')
+    plt.show()
+
+
+def dot_graph(graph):
+    dot_graph = pydot.Dot(graph_type='digraph', concentrate=True, rankdir="LR")
+    dot_graph.set_node_defaults(shape='rect', fontsize=12)
+    for n in graph._nodes:
+        node_name = graph.node_label_fn(n)
+        node = pydot.Node(shape="ellipse", name=node_name)
+        if n in graph.node_positions:
+            node.set_pos("%d,%d!" % (graph.node_positions[n][0], graph.node_positions[n][1]))
+        dot_graph.add_node(node)
+    for src_node, edges in graph._edges.items():
+        for e in edges:
+            dot_graph.add_edge(pydot.Edge(graph.node_label_fn(src_node), graph.node_label_fn(e.target), label=e.weight if e.weight!=1.0 else ""))
+    return dot_graph
+
+
+def display_path(path, graph):
+    from IPython.display import display_svg
+    dot = dot_graph(graph)
+    for n in dot.get_nodes():
+        if n.get_name() == path.path[0]:
+            n.set_color('blue')
+        elif n.get_name() == path.path[-1]:
+            n.set_color('green')
+        elif n.get_name() in path.path:
+            n.set_color('red')
+    edges = list(path.edges())
+    for e in dot.get_edges():
+        if (e.get_source(), e.get_destination()) in edges:
+            e.set_color('red')
+    dot.set_concentrate(False)
+    display_svg(dot.create_svg(), raw=True)
+
+
+def _position(graph, node):
+    pos = graph.node_positions.get(node, node) if graph is not None else node
+    return pos[0], pos[1]
+
+
+def edge_segments(graph, max_edges=None):
+    """(E, 2, 2) array of graph's edges as segments between node positions
+    (a node without a position is taken to be its own (x, y)). Edges in
+    both directions appear once. With max_edges, an evenly spaced subset
+    of at most that many is returned."""
+    if hasattr(graph, 'indptr'):
+        sources = np.repeat(np.arange(len(graph.labels)), np.diff(graph.indptr))
+        targets = np.asarray(graph.indices)
+        xy = np.array([_position(graph, n) for n in graph.labels], dtype=float).reshape(-1, 2)
+        keep = sources < targets
+        pairs = np.unique(np.column_stack([sources, targets])[keep], axis=0) if keep.any() else np.zeros((0, 2), int)
+        single = ~keep & (sources != targets)
+        if single.any():
+            reverse = set(map(tuple, pairs.tolist()))
+            extra = [(t, s) for s, t in zip(sources[single].tolist(), targets[single].tolist())
+                     if (t, s) not in reverse]
+            if extra:
+                pairs = np.vstack([pairs, np.array(sorted(set(extra)))])
+        segments = xy[pairs]
+    else:
+        seen, segments = set(), []
+        for source, edges in graph._edges.items():
+            for e in edges:
+                key = frozenset((source, e.target))
+                if len(key) == 2 and key not in seen:
+                    seen.add(key)
+                    segments.append((_position(graph, source), _position(graph, e.target)))
+        segments = np.array(segments, dtype=float).reshape(-1, 2, 2)
+    if max_edges is not None and len(segments) > max_edges:
+        segments = segments[np.linspace(0, len(segments) - 1, max_edges).astype(int)]
+    return segments
+
+
+def render_png(filename, env=None, graph=None, paths=(), bounds=None, expanded=False, width=12.0, dpi=100,
+               max_edges=20000, max_labels=200, path_colors=None):
+    """Draw env's obstacles (expanded_obstacles if expanded), graph's
+    edges and every Path in paths into one image written to filename.
+
+    Obstacles are a single collection; edges above max_edges are thinned
+    to an evenly spaced subset and nodes are labelled only when there are
+    at most max_labels of them. Paths are drawn in path_colors (default: a
+    qualitative colormap, cycled) with their starts and ends marked.
+    Nothing goes through pyplot, so no window is opened. Returns the
+    number of edges drawn."""
+    if bounds is None:
+        if env is not None and env.bounds is not None:
+            bounds = env.bounds
+        else:
+            points = [p for path in paths for p in path.path]
+            if graph is not None:
+                points += [_position(graph, n) for n in (graph.labels if hasattr(graph, 'labels') else graph._nodes)]
+            xy = np.array(points, dtype=float).reshape(-1, 2)[:, :2]
+            bounds = tuple(xy.min(axis=0)) + tuple(xy.max(axis=0)) if len(xy) else (-1, -1, 1, 1)
+    minx, miny, maxx, maxy = bounds
+    height = max(1.0, width * (maxy - miny) / max(maxx - minx, 1e-9))
+    fig = Figure(figsize=(width, height))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    if env is not None:
+        polygons = env.expanded_obstacles if expanded else env.obstacles
+        ax.add_collection(polygon_collection(polygons, facecolor='blue', edgecolor='blue', alpha=0.5,
+                                             linewidth=0.5, zorder=20))
+    n_edges = 0
+    if graph is not None:
+        segments = edge_segments(graph, max_edges)
+        n_edges = len(segments)
+        ax.add_collection(LineCollection(segments, colors='gray', linewidths=0.3, alpha=0.6, zorder=10))
+        nodes = graph.labels if hasattr(graph, 'labels') else list(graph._nodes)
+        if len(nodes) <= max_labels:
+            for n in nodes:
+                x, y = _position(graph, n)
+                ax.annotate(str(n), (x, y), fontsize=6, zorder=30)
+    if paths:
+        if path_colors is None:
+            cmap = plt.get_cmap('tab10')
+            path_colors = [cmap(i % 10) for i in range(len(paths))]
+        lines = [np.array([_position(graph, s) for s in path.path], dtype=float) for path in paths]
+        ax.add_collection(LineCollection(lines, colors=path_colors, linewidths=2, zorder=40))
+        ends = np.array([(line[0], line[-1]) for line in lines])
+        ax.scatter(ends[:, 0, 0], ends[:, 0, 1], marker='o', c='green', s=20, zorder=50)
+        ax.scatter(ends[:, 1, 0], ends[:, 1, 1], marker='*', c='red', s=40, zorder=50)
+    ax.set_xlim(minx, maxx)
+    ax.set_ylim(miny, maxy)
+    ax.set_aspect('equal', adjustable='box')
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    return n_edges